@@ -0,0 +1,57 @@
+import numpy as np
+from geometry_utils.vector3D import Vector3D
+
+class AgentStateStore:
+    """Kinematic state of a population of agents as contiguous (agents, 3) float64 arrays.
+
+    Each agent owns a row: reading one of its FIELDS returns a new Vector3D with the row
+    values, assigning a Vector3D copies it into the row.
+    """
+    FIELDS = ("position", "orientation", "forward_vector", "prev_position", "prev_orientation", "delta_orientation")
+
+    def __init__(self, num_agents:int):
+        self.num_agents = num_agents
+        self.arrays = {field: np.zeros((num_agents, 3)) for field in AgentStateStore.FIELDS}
+        self.dt = np.zeros(num_agents)
+
+    @staticmethod
+    def gather(entities):
+        """Store holding the current state of entities, which are attached to it in order."""
+        store = AgentStateStore(len(entities))
+        for row, entity in enumerate(entities):
+            for field in AgentStateStore.FIELDS:
+                store.arrays[field][row] = entity.state_store.arrays[field][entity.state_row]
+            store.dt[row] = 1.0 / entity.ticks_per_second
+            entity.attach_state(store, row)
+        return store
+
+    def get(self, field:str, row:int) -> Vector3D:
+        x, y, z = self.arrays[field][row].tolist()
+        return Vector3D(x, y, z)
+
+    def set(self, field:str, row:int, value:Vector3D):
+        values = self.arrays[field][row]
+        values[0] = value.x
+        values[1] = value.y
+        values[2] = value.z
+
+    def integrate(self, rows):
+        """position += forward_vector * dt for the given rows."""
+        self.arrays["position"][rows] += self.arrays["forward_vector"][rows] * self.dt[rows, None]
+
+    @staticmethod
+    def columns(entities, field:str):
+        """(len(entities), 3) array of field, gathered straight from the store when they share one."""
+        store = getattr(entities[0], "state_store", None) if entities else None
+        if store is not None and all(getattr(e, "state_store", None) is store for e in entities):
+            return store.arrays[field][[e.state_row for e in entities]]
+        return np.array([[v.x, v.y, v.z] for v in (getattr(e, field) for e in entities)], dtype=float).reshape(-1, 3)
+
+
+def state_property(field:str):
+    """Attribute of an agent kept in its AgentStateStore row."""
+    def getter(self):
+        return self.state_store.get(field, self.state_row)
+    def setter(self, value):
+        self.state_store.set(field, self.state_row, value)
+    return property(getter, setter)
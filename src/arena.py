@@ -32,6 +32,8 @@ class Arena():
         self.objects = {object_type: (config_elem.environment.get("objects",{}).get(object_type),[]) for object_type in config_elem.environment.get("objects",{}).keys()}
         self.agents_shapes = {}
         self.agents_spins = {}
+        self.shared_state = None
+        self.state_write = None
         self.data_handling = None
         if len(config_elem.results) > 0 and not len(config_elem.gui) > 0 : self.data_handling = DataHandlingFactory.create_data_handling(config_elem)
 
@@ -65,6 +67,28 @@ class Arena():
     def run(self,num_runs,time_limit, arena_queue:mp.Queue, agents_queue:mp.Queue, gui_in_queue:mp.Queue, dec_arena_in:mp.Queue, gui_control_queue:mp.Queue, render:bool=False):
         pass
 
+    def set_shared_state(self, shared_state):
+        """SharedAgentState the agents are read from when the agents messages only carry the number of a write."""
+        self.shared_state = shared_state
+
+    def update_agents(self, data_in):
+        if "agents_shapes" in data_in:
+            self.agents_shapes = data_in["agents_shapes"]
+            self.agents_spins = data_in["agents_spins"]
+        elif self.shared_state is not None:
+            self.state_write = data_in["state_write"]
+            spins = self.shared_state.update_shapes(self.agents_shapes, self.agents_spins, self.state_write)
+            if spins is None:
+                # the saved and shown state must be the one of the tick
+                raise RuntimeError(f"Shared state write {self.state_write} was overwritten before the arena read it.")
+            self.agents_spins = spins
+
+    def pack_gui_data(self, arena_data, full:bool=True) -> dict:
+        """Message for the gui: with shared_state the agents only go with full, once per run, then the write to read."""
+        if self.shared_state is not None and not full:
+            return {**arena_data, "state_write": self.state_write}
+        return {**arena_data, "agents_shapes": self.agents_shapes, "agents_spins": self.agents_spins}
+
     def reset(self):
         self.set_random_seed()
 
@@ -187,13 +211,12 @@ class SolidArena(Arena):
                 "objects": self.pack_objects_data()
             }
             if render:
-                gui_in_queue.put({**arena_data, "agents_shapes": self.agents_shapes, "agents_spins": self.agents_spins})
+                gui_in_queue.put(self.pack_gui_data(arena_data))
             arena_queue.put({**arena_data, "random_seed": self.random_seed})
 
             while agents_queue.qsize() == 0: pass
             data_in = agents_queue.get()
-            self.agents_shapes = data_in["agents_shapes"]
-            self.agents_spins = data_in["agents_spins"]
+            self.update_agents(data_in)
             if self.data_handling is not None: self.data_handling.new_run(run,self.agents_shapes,self.agents_spins)
             t = 1
             running = False if render else True
@@ -226,19 +249,17 @@ class SolidArena(Arena):
                             "status": [t,self.ticks_per_second],
                             "objects": self.pack_objects_data()
                         }
-                        detector_data = {
-                            "objects": self.pack_detector_data()
-                        }
                         if arena_queue.qsize()==0:
                             arena_queue.put(arena_data)
-                            dec_arena_in.put(detector_data)
+                            # None when no detector process runs
+                            if dec_arena_in is not None:
+                                dec_arena_in.put({"objects": self.pack_detector_data()})
 
                     if agents_queue.qsize()>0: data_in = agents_queue.get()
-                    self.agents_shapes = data_in["agents_shapes"]
-                    self.agents_spins = data_in["agents_spins"]
+                    self.update_agents(data_in)
                     if self.data_handling is not None: self.data_handling.save(self.agents_shapes,self.agents_spins)
                     if render:
-                        gui_in_queue.put({**arena_data, "agents_shapes": self.agents_shapes, "agents_spins": self.agents_spins})
+                        gui_in_queue.put(self.pack_gui_data(arena_data, full=t == 1))
                     step_mode = False
                     t += 1
                 elif reset:
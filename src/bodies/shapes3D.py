@@ -1,7 +1,9 @@
 import math
-from geometry_utils.vector3D import Vector3D
+import numpy as np
+from geometry_utils.vector3D import Vector3D, Vector3DArray
 
 _PI = math.pi
+_TEMPLATES = {}
 class Shape3DFactory:
     @staticmethod
     def create_shape(_object:str, shape_type:str, config_elem:dict):
@@ -26,9 +28,29 @@ class Shape:
         self._object = "arena"
         self._id = "point"
         self._color = config_elem.get("color", "black")
-        self.vertices_list = []
+        self.vertex_array = Vector3DArray()
+        self._vertices_cache = []
+        self._bounds = ((0.0, 0.0, 0.0), (0.0, 0.0, 0.0))
         self.attachments = []
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_vertices_cache"] = None
+        return state
+
+    @property
+    def vertices_list(self) -> list:
+        """Vertices as Vector3D, materialized from vertex_array on first access after a move."""
+        if self._vertices_cache is None:
+            self._vertices_cache = self.vertex_array.to_list()
+        return self._vertices_cache
+
+    @vertices_list.setter
+    def vertices_list(self, vertices):
+        self.vertex_array = Vector3DArray.from_vectors(vertices)
+        self._vertices_cache = None
+        self._bounds = None
+
     def add_attachment(self, attachment):
         self.attachments.append(attachment)
 
@@ -70,9 +92,49 @@ class Shape:
         return 0
 
     def set_vertices(self):
-        pass
+        if self._object != "arena" and self._id in Shape.flat_shapes:
+            self.center.z = 0
+        # arena vertices keep their absolute z, from 0 to height
+        self.place_template(0.0 if self._object == "arena" else self.center.z)
+
+    def template_key(self):
+        """Everything the vertices at the origin depend on."""
+        return None
+
+    def build_template(self):
+        """(n, 3) array of the vertices of the shape centred at the origin."""
+        return np.zeros((0, 3))
+
+    def place_template(self, z:float):
+        """Vertices from the cached template of the shape, offset to the center at height z."""
+        key = self.template_key()
+        cached = _TEMPLATES.get(key)
+        if cached is None:
+            template = self.build_template()
+            template.setflags(write=False)
+            bounds = (template.min(axis=0).tolist(), template.max(axis=0).tolist()) if len(template) else None
+            cached = (template, bounds)
+            _TEMPLATES[key] = cached
+        template, bounds = cached
+        offset = (self.center.x, self.center.y, z)
+        self.vertex_array = Vector3DArray(template + offset)
+        self._vertices_cache = None
+        if bounds is None:
+            self._bounds = ((0.0, 0.0, 0.0), (0.0, 0.0, 0.0))
+        else:
+            # adding a constant preserves the order of floats, so the template bounds move exactly with it
+            self._bounds = tuple(tuple(b + o for b, o in zip(bound, offset)) for bound in bounds)
 
     def check_overlap(self, _shape):
+        """(True, contact point) if the shape intersects _shape, or sticks out of it when _shape is the arena.
+
+        Circles (Cylinder) and boxes (Cuboid, by their vertex bounds) are tested in closed form
+        in the xy plane; any other pair falls back to testing the vertices of each shape
+        against the other.
+        """
+        overlap = self._analytic_overlap(_shape)
+        if overlap is not None:
+            return overlap
         for vertex in self.vertices_list:
             if _shape._object == "arena":
                 if not self._is_point_inside_shape(vertex, _shape):
@@ -85,6 +147,58 @@ class Shape:
                 return True, vertex
         return False, Vector3D()
 
+    def _footprint(self):
+        if isinstance(self, Cylinder):
+            return "circle"
+        if isinstance(self, Cuboid):
+            return "box"
+        return None
+
+    def _analytic_overlap(self, _shape):
+        """Closed-form check_overlap for circle and box footprints, None for any other pair."""
+        footprint = self._footprint()
+        other_footprint = _shape._footprint()
+        if footprint is None or other_footprint is None:
+            return None
+        z = self.center.z
+        if footprint == "circle":
+            r = self.radius
+            lo_x, lo_y = self.center.x - r, self.center.y - r
+            hi_x, hi_y = self.center.x + r, self.center.y + r
+        else:
+            (lo_x, lo_y, _), (hi_x, hi_y, _) = self.bounds()
+        if _shape._object == "arena":
+            if other_footprint == "circle":
+                return self._outside_circle(_shape.center, _shape.radius, lo_x, lo_y, hi_x, hi_y, z)
+            return _outside_box(self.center, lo_x, lo_y, hi_x, hi_y, _shape.bounds(), z)
+        if footprint == "circle" and other_footprint == "circle":
+            return _circles_overlap(self.center, self.radius, _shape.center, _shape.radius, z)
+        if footprint == "circle":
+            return _circle_box_overlap(self.center, self.radius, _shape.bounds(), z)
+        if other_footprint == "circle":
+            return _circle_box_overlap(_shape.center, _shape.radius, ((lo_x, lo_y), (hi_x, hi_y)), z)
+        (other_lo_x, other_lo_y, _), (other_hi_x, other_hi_y, _) = _shape.bounds()
+        x0, x1 = max(lo_x, other_lo_x), min(hi_x, other_hi_x)
+        y0, y1 = max(lo_y, other_lo_y), min(hi_y, other_hi_y)
+        if x0 > x1 or y0 > y1:
+            return False, Vector3D()
+        return True, Vector3D((x0 + x1) * 0.5, (y0 + y1) * 0.5, z)
+
+    def _outside_circle(self, center, radius, lo_x, lo_y, hi_x, hi_y, z):
+        """Point of the shape farthest from center, if it lies outside the circle."""
+        if self._footprint() == "circle":
+            dx, dy = self.center.x - center.x, self.center.y - center.y
+            distance = math.hypot(dx, dy)
+            if distance + self.radius <= radius:
+                return False, Vector3D()
+            ux, uy = (dx / distance, dy / distance) if distance > 0 else (1.0, 0.0)
+            return True, Vector3D(self.center.x + ux * self.radius, self.center.y + uy * self.radius, z)
+        x = lo_x if abs(lo_x - center.x) > abs(hi_x - center.x) else hi_x
+        y = lo_y if abs(lo_y - center.y) > abs(hi_y - center.y) else hi_y
+        if math.hypot(x - center.x, y - center.y) <= radius:
+            return False, Vector3D()
+        return True, Vector3D(x, y, z)
+
     def _get_random_point_inside_shape(self, random_generator, arena_shape):
         if isinstance(arena_shape, (Cylinder, Sphere)):
             angle = random_generator.uniform(0, 2 * _PI)
@@ -118,44 +232,66 @@ class Shape:
             distance = math.sqrt(dx * dx + dy * dy + dz * dz)
             return distance <= shape.radius
         else:
-            min_v = shape.min_vert()
-            max_v = shape.max_vert()
-            return (min_v.x <= point.x <= max_v.x and
-                    min_v.y <= point.y <= max_v.y and
-                    min_v.z <= point.z <= max_v.z)
+            min_v, max_v = shape.bounds()
+            return (min_v[0] <= point.x <= max_v[0] and
+                    min_v[1] <= point.y <= max_v[1] and
+                    min_v[2] <= point.z <= max_v[2])
 
     def rotate(self, angle_z: float):
         angle_rad_z = math.radians(angle_z)
         if angle_rad_z > 0:
-            cos_z = math.cos(angle_rad_z)
-            sin_z = math.sin(angle_rad_z)
-            cx, cy = self.center.x, self.center.y
-            for vertex in self.vertices_list:
-                # Ottimizza la rotazione solo sul piano XY
-                x_shift = vertex.x - cx
-                y_shift = vertex.y - cy
-                x_new = cx + x_shift * cos_z - y_shift * sin_z
-                y_new = cy + x_shift * sin_z + y_shift * cos_z
-                vertex.x, vertex.y = x_new, y_new
+            # Ottimizza la rotazione solo sul piano XY
+            self.vertex_array.rotate_z(self.center, angle_rad_z)
+            self._vertices_cache = None
+            self._bounds = None
+
+    def bounds(self):
+        """Cached (min, max) corners of the axis-aligned bounding box of the vertices, as tuples."""
+        if self._bounds is None:
+            min_v, max_v = self.vertex_array.min(), self.vertex_array.max()
+            self._bounds = ((min_v.x, min_v.y, min_v.z), (max_v.x, max_v.y, max_v.z))
+        return self._bounds
 
     def min_vert(self):
-        # Usa min/max con generator expression per efficienza
-        if not self.vertices_list:
-            return Vector3D()
-        return Vector3D(
-            min(v.x for v in self.vertices_list),
-            min(v.y for v in self.vertices_list),
-            min(v.z for v in self.vertices_list)
-        )
+        x, y, z = self.bounds()[0]
+        return Vector3D(x, y, z)
 
     def max_vert(self):
-        if not self.vertices_list:
-            return Vector3D()
-        return Vector3D(
-            max(v.x for v in self.vertices_list),
-            max(v.y for v in self.vertices_list),
-            max(v.z for v in self.vertices_list)
-        )
+        x, y, z = self.bounds()[1]
+        return Vector3D(x, y, z)
+
+def _circles_overlap(center, radius, other_center, other_radius, z):
+    """Midpoint of the overlap of the two circles along the line joining their centres."""
+    dx, dy = other_center.x - center.x, other_center.y - center.y
+    distance = math.sqrt(dx * dx + dy * dy)
+    if distance > radius + other_radius:
+        return False, Vector3D()
+    ux, uy = (dx / distance, dy / distance) if distance > 0 else (1.0, 0.0)
+    t = (max(-radius, distance - other_radius) + min(radius, distance + other_radius)) * 0.5
+    return True, Vector3D(center.x + ux * t, center.y + uy * t, z)
+
+def _circle_box_overlap(center, radius, bounds, z):
+    """Point of the box (min, max corners) closest to the centre of the circle, if it lies in the circle."""
+    min_v, max_v = bounds
+    x = min(max(center.x, min_v[0]), max_v[0])
+    y = min(max(center.y, min_v[1]), max_v[1])
+    if math.hypot(x - center.x, y - center.y) > radius:
+        return False, Vector3D()
+    return True, Vector3D(x, y, z)
+
+def _outside_box(center, lo_x, lo_y, hi_x, hi_y, bounds, z):
+    """Point of the extent [lo, hi] sticking out farthest past the box (min, max corners), if any does."""
+    min_v, max_v = bounds
+    excess, x, y = max(
+        (min_v[0] - lo_x, lo_x, center.y),
+        (hi_x - max_v[0], hi_x, center.y),
+        (min_v[1] - lo_y, center.x, lo_y),
+        (hi_y - max_v[1], center.x, hi_y),
+        key=lambda side: side[0]
+    )
+    if excess <= 0:
+        return False, Vector3D()
+    return True, Vector3D(x, y, z)
 
 class Sphere(Shape):
     def __init__(self, _object: str, shape_type: str, config_elem: dict, center: Vector3D = Vector3D()):
@@ -175,10 +311,15 @@ class Sphere(Shape):
         return 4 * _PI * self.radius ** 2
 
     def set_vertices(self):
-        self.vertices_list = []
+        self.place_template(self.center.z)
+
+    def template_key(self):
+        return ("sphere", self.radius, 32)
+
+    def build_template(self):
         num_vertices = 32
-        cx, cy, cz = self.center.x, self.center.y, self.center.z
         r = self.radius
+        vertices = []
         for i in range(num_vertices):
             theta = 2 * _PI * (i / num_vertices)
             cos_theta = math.cos(theta)
@@ -186,10 +327,8 @@ class Sphere(Shape):
             for j in range(num_vertices):
                 phi = _PI * j / num_vertices
                 sin_phi = math.sin(phi)
-                x = cx + r * sin_phi * cos_theta
-                y = cy + r * sin_phi * sin_theta
-                z = cz + r * math.cos(phi)
-                self.vertices_list.append(Vector3D(x, y, z))
+                vertices.append((r * sin_phi * cos_theta, r * sin_phi * sin_theta, r * math.cos(phi)))
+        return np.array(vertices, dtype=float)
 
 class Cuboid(Shape):
     def __init__(self, _object: str, shape_type: str, config_elem: dict, center: Vector3D = Vector3D()):
@@ -213,42 +352,49 @@ class Cuboid(Shape):
         else:
             return 2 * (self.width * self.height + self.height * self.depth + self.depth * self.width)
 
-    def set_vertices(self):
+    def template_key(self):
+        if self._object == "arena":
+            kind = "arena"
+        elif self._id in Shape.flat_shapes:
+            kind = "flat"
+        else:
+            kind = "dense"
+        return ("cuboid", kind, self.width, self.height, self.depth)
+
+    def build_template(self):
         half_width = self.width * 0.5
         half_height = self.height * 0.5
         half_depth = self.depth * 0.5
-        cx, cy, cz = self.center.x, self.center.y, self.center.z
         if self._object == "arena":
-            self.vertices_list = [
-                Vector3D(cx - half_width, cy - half_depth, 0),
-                Vector3D(cx - half_width, cy - half_depth, self.height),
-                Vector3D(cx + half_width, cy - half_depth, 0),
-                Vector3D(cx + half_width, cy - half_depth, self.height),
-                Vector3D(cx + half_width, cy + half_depth, 0),
-                Vector3D(cx + half_width, cy + half_depth, self.height),
-                Vector3D(cx - half_width, cy + half_depth, 0),
-                Vector3D(cx - half_width, cy + half_depth, self.height)
+            vertices = [
+                (-half_width, -half_depth, 0),
+                (-half_width, -half_depth, self.height),
+                (half_width, -half_depth, 0),
+                (half_width, -half_depth, self.height),
+                (half_width, half_depth, 0),
+                (half_width, half_depth, self.height),
+                (-half_width, half_depth, 0),
+                (-half_width, half_depth, self.height)
+            ]
+        elif self._id in Shape.flat_shapes:
+            vertices = [
+                (-half_width, -half_depth, 0),
+                (half_width, -half_depth, 0),
+                (half_width, half_depth, 0),
+                (-half_width, half_depth, 0)
             ]
         else:
-            if self._id in Shape.flat_shapes:
-                self.center.z = 0
-                self.vertices_list = [
-                    Vector3D(cx - half_width, cy - half_depth, 0),
-                    Vector3D(cx + half_width, cy - half_depth, 0),
-                    Vector3D(cx + half_width, cy + half_depth, 0),
-                    Vector3D(cx - half_width, cy + half_depth, 0)
-                ]
-            else:
-                self.vertices_list = [
-                    Vector3D(cx - half_width, cy - half_depth, cz - half_height),
-                    Vector3D(cx - half_width, cy - half_depth, cz + half_height),
-                    Vector3D(cx + half_width, cy - half_depth, cz - half_height),
-                    Vector3D(cx + half_width, cy - half_depth, cz + half_height),
-                    Vector3D(cx + half_width, cy + half_depth, cz - half_height),
-                    Vector3D(cx + half_width, cy + half_depth, cz + half_height),
-                    Vector3D(cx - half_width, cy + half_depth, cz - half_height),
-                    Vector3D(cx - half_width, cy + half_depth, cz + half_height)
-                ]
+            vertices = [
+                (-half_width, -half_depth, -half_height),
+                (-half_width, -half_depth, half_height),
+                (half_width, -half_depth, -half_height),
+                (half_width, -half_depth, half_height),
+                (half_width, half_depth, -half_height),
+                (half_width, half_depth, half_height),
+                (-half_width, half_depth, -half_height),
+                (-half_width, half_depth, half_height)
+            ]
+        return np.array(vertices, dtype=float)
 
 class Cylinder(Shape):
     def __init__(self, _object: str, shape_type: str, config_elem: dict, center: Vector3D = Vector3D()):
@@ -268,42 +414,35 @@ class Cylinder(Shape):
     def surface_area(self):
         return 2 * _PI * self.radius * (self.radius + self.height)
 
-    def set_vertices(self):
-        self.vertices_list = []
+    def template_key(self):
+        if self._object == "arena":
+            return ("cylinder", "arena", self.radius, self.height, 20)
+        num_vertices = 8 if self._object == "mark" else 16
+        kind = "flat" if self._id in Shape.flat_shapes else "dense"
+        return ("cylinder", kind, self.radius, self.height, num_vertices)
+
+    def build_template(self):
+        vertices = []
         if self._object == "arena":
             num_vertices = 20
             angle_increment = 2 * _PI / num_vertices
-            cx, cy = self.center.x, self.center.y
             for i in range(num_vertices):
                 angle = i * angle_increment
-                cos_a = math.cos(angle)
-                sin_a = math.sin(angle)
-                x = cx + self.radius * cos_a
-                y = cy + self.radius * sin_a
-                z1 = 0
-                z2 = self.height
-                self.vertices_list.append(Vector3D(x, y, z1))
-                self.vertices_list.append(Vector3D(x, y, z2))
+                x = self.radius * math.cos(angle)
+                y = self.radius * math.sin(angle)
+                vertices.append((x, y, 0))
+                vertices.append((x, y, self.height))
         else:
             num_vertices = 8 if self._object == "mark" else 16
             angle_increment = 2 * _PI / num_vertices
-            cx, cy, cz = self.center.x, self.center.y, self.center.z
-            if self._id in Shape.flat_shapes:
-                self.center.z = 0
-                for i in range(num_vertices):
-                    angle = i * angle_increment
-                    cos_a = math.cos(angle)
-                    sin_a = math.sin(angle)
-                    x = cx + self.radius * cos_a
-                    y = cy + self.radius * sin_a
-                    self.vertices_list.append(Vector3D(x, y, 0))
-            else:
-                half_height = self.height * 0.5
-                for i in range(num_vertices):
-                    angle = i * angle_increment
-                    cos_a = math.cos(angle)
-                    sin_a = math.sin(angle)
-                    x = cx + self.radius * cos_a
-                    y = cy + self.radius * sin_a
-                    self.vertices_list.append(Vector3D(x, y, cz - half_height))
-                    self.vertices_list.append(Vector3D(x, y, cz + half_height))
\ No newline at end of file
+            half_height = self.height * 0.5
+            for i in range(num_vertices):
+                angle = i * angle_increment
+                x = self.radius * math.cos(angle)
+                y = self.radius * math.sin(angle)
+                if self._id in Shape.flat_shapes:
+                    vertices.append((x, y, 0))
+                else:
+                    vertices.append((x, y, -half_height))
+                    vertices.append((x, y, half_height))
+        return np.array(vertices, dtype=float)
@@ -1,126 +1,377 @@
+import math
 import multiprocessing as mp
+import numpy as np
 from geometry_utils.vector3D import Vector3D
+from bodies.shapes3D import Cylinder
+from spatialgrid import SpatialGrid
+from staticfield import StaticField, footprint_radius
+
+# Imposta su False per disattivare tutte le stampe di debug
+DEBUG_MODE = True
 
 class CollisionDetector:
-    def __init__(self, arena_shape, collisions):
+    def __init__(self, arena_shape, collisions, field_resolution:float=0.0):
         self.arena_shape = arena_shape
         self.collisions = collisions
+        # > 0: arena walls and objects are tested through a StaticField with nodes this far apart
+        self.field_resolution = float(field_resolution or 0.0)
+        self.agents = {}
+        self.shared_state = None
+        self.layout = None
+        self.set_objects({})
+
+    @staticmethod
+    def build_grid(groups):
+        """SpatialGrid of the (group, index) of every shape in groups of (shapes, positions), and their largest radius.
+
+        A shape can only touch another one within its radius plus the largest radius,
+        so querying that distance around it returns all its candidate pairs.
+        """
+        max_radius = 0.0
+        for shapes, _ in groups:
+            for shape in shapes:
+                max_radius = max(max_radius, bounding_radius(shape))
+        grid = SpatialGrid(max(2 * max_radius, 1e-6))
+        for g, (_, positions) in enumerate(groups):
+            for m, position in enumerate(positions):
+                grid.add((g, m), position)
+        return grid, max_radius
+
+    def set_objects(self, objects):
+        """Objects of the arena: grid, arrays and static field are only rebuilt when their layout changes."""
+        self.objects = objects
+        self.object_groups = list(objects.values())
+        self.object_shapes = [shape for shapes, _ in self.object_groups for shape in shapes]
+        self.object_positions = [position for _, positions in self.object_groups for position in positions]
+        layout = (tuple(len(shapes) for shapes, _ in self.object_groups),
+                  StaticField.layout_key(self.arena_shape, self.object_shapes, self.field_resolution))
+        if layout == self.layout:
+            return
+        self.layout = layout
+        self.object_grid, self.max_object_radius = CollisionDetector.build_grid(self.object_groups)
+        self.object_offsets = np.cumsum([0] + [len(shapes) for shapes, _ in self.object_groups])
+        self.object_arrays = ShapeArrays(self.object_shapes, self.object_positions)
+        self.field = None
+        if self.field_resolution > 0:
+            # without collisions agents only meet the arena walls
+            static_shapes = self.object_shapes if self.collisions else []
+            self.field = StaticField.shared(self.arena_shape, static_shapes, self.field_resolution)
 
     def run(self, dec_agents_in: mp.Queue, dec_agents_out: mp.Queue, dec_arena_in: mp.Queue):
-        # Imposta su False per disattivare tutte le stampe di debug
-        DEBUG_MODE = True
-        
-        self.agents, self.objects = {}, {}
         while True:
-            out = {}
             if dec_arena_in.qsize() > 0:
-                self.objects = dec_arena_in.get()["objects"]
+                self.set_objects(dec_arena_in.get()["objects"])
             if dec_agents_in.qsize() > 0:
-                self.agents = dec_agents_in.get()["agents"]
-                for k, (shapes, velocities, vectors, positions, names) in self.agents.items():
-                    n_shapes = len(shapes)
-                    out_tmp = [None] * n_shapes
-                    for n in range(n_shapes):
-                        shape = shapes[n]
-                        max_velocity = velocities[n]
-                        forward_vector = vectors[n]
-                        position = positions[n]
-                        name = names[n]
-
-                        # Inizializzazione delle variabili per accumulare le correzioni
-                        collision_detected = False
-                        total_velocity_projection = Vector3D()
-                        total_separation_vector = Vector3D()
-                        
-                        # Lista per accumulare i messaggi di debug per questo agente in questo tick
-                        debug_log = []
-
-                        if self.collisions:
-                            # --- Collisions with other agents ---
-                            for dshapes, dvelocities, dvectors, dpositions, dnames in self.agents.values():
-                                for m, dshape in enumerate(dshapes):
-                                    dforward_vector, dposition, dname = dvectors[m], dpositions[m], dnames[m]
-                                    if name == dname: continue
-                                    
-                                    delta = position - dposition
-                                    sum_radius = shape.get_radius() + dshape.get_radius()
-                                    if delta.magnitude() > sum_radius: continue
-                                    
-                                    overlap = shape.check_overlap(dshape)
-                                    if overlap[0]:
-                                        collision_detected = True
-                                        velocity_projection = get_collision_normal(overlap[1], dshape, max_velocity) - forward_vector + dforward_vector
-                                        total_velocity_projection += velocity_projection
-                                        
-                                        penetration_depth = sum_radius - delta.magnitude()
-                                        if delta.magnitude() > 0:
-                                            separation = delta.normalize() * penetration_depth * 0.1
-                                            total_separation_vector += separation
-                                            if DEBUG_MODE:
-                                                debug_log.append(f"  - AGENT COLLISION with '{dname}':")
-                                                debug_log.append(f"    - Velocity Proj.: {velocity_projection}")
-                                                debug_log.append(f"    - Separation Vec.: {separation}")
-
-                            # --- Collisions with objects ---
-                            for dshapes, dpositions in self.objects.values():
-                                for m, dshape in enumerate(dshapes):
-                                    dposition = dpositions[m]
-                                    delta = position - dposition
-                                    sum_radius = shape.get_radius() + dshape.get_radius()
-                                    if delta.magnitude() > sum_radius: continue
-                                    
-                                    overlap = shape.check_overlap(dshape)
-                                    if overlap[0]:
-                                        collision_detected = True
-                                        velocity_projection = get_collision_normal(overlap[1], dshape, max_velocity) - forward_vector
-                                        total_velocity_projection += velocity_projection
-                                        
-                                        penetration_depth = sum_radius - delta.magnitude()
-                                        if delta.magnitude() > 0:
-                                            separation = delta.normalize() * penetration_depth * 0.1
-                                            total_separation_vector += separation
-                                            if DEBUG_MODE:
-                                                debug_log.append(f"  - OBJECT COLLISION at {dposition}:")
-                                                debug_log.append(f"    - Velocity Proj.: {velocity_projection}")
-                                                debug_log.append(f"    - Separation Vec.: {separation}")
-
-                        # --- Collisions with arena borders ---
-                        overlap = shape.check_overlap(self.arena_shape)
-                        if overlap[0]:
-                            collision_detected = True
-                            velocity_projection = get_collision_normal(overlap[1], self.arena_shape, max_velocity) - forward_vector
-                            total_velocity_projection += velocity_projection
-                            
-                            delta_arena = Vector3D(overlap[1].x, overlap[1].y, 0)
-                            separation = delta_arena.normalize() * -0.01
-                            total_separation_vector += separation
-                            if DEBUG_MODE:
-                                debug_log.append("  - ARENA BORDER COLLISION:")
-                                debug_log.append(f"    - Velocity Proj.: {velocity_projection}")
-                                debug_log.append(f"    - Separation Vec.: {separation}")
-
-                        # --- Applica le correzioni e stampa il report di debug se necessario ---
-                        if collision_detected:
-                            final_position = position + total_velocity_projection + total_separation_vector
-                            out_tmp[n] = final_position
-                            
-                            if DEBUG_MODE:
-                                print(f"\n--- DEBUG: Collision Detected for Agent '{name}' ---")
-                                print(f"Initial Position: {position}")
-                                print(f"Initial Vector:   {forward_vector}")
-                                # Stampa i dettagli delle singole collisioni
-                                for log_entry in debug_log:
-                                    print(log_entry)
-                                print("-------------------------------------------------")
-                                print(f"Total Velocity Projection: {total_velocity_projection}")
-                                print(f"Total Separation Vector:   {total_separation_vector}")
-                                print(f"FINAL Calculated Position: {final_position}")
-                                print("-------------------------------------------------")
-                        else:
-                            out_tmp[n] = None
-
-                    out[k] = out_tmp
-                dec_agents_out.put(out)
+                data_in = dec_agents_in.get()
+                if "agents" in data_in:
+                    self.agents = data_in["agents"]
+                else:
+                    self.shared_state.update_detector_data(self.agents, data_in["state_write"])
+                dec_agents_out.put(self.detect(self.agents))
+
+    def set_shared_state(self, shared_state):
+        """SharedAgentState the agents are read from when the queue only carries the number of a write."""
+        self.shared_state = shared_state
+
+    def resolve(self, agents, objects=None):
+        """Same answer as the detector process, computed in the caller's process.
+
+        agents and objects are laid out as in the detector queues; objects may be omitted
+        when they did not change.
+        """
+        if objects is not None:
+            self.set_objects(objects)
+        self.agents = agents
+        return self.detect(agents)
+
+    def detect(self, agents):
+        """Corrected position of every colliding agent, None for the others, per agent type."""
+        groups = list(agents.values())
+        shapes = [shape for g in groups for shape in g[0]]
+        velocities = [velocity for g in groups for velocity in g[1]]
+        vectors = [vector for g in groups for vector in g[2]]
+        positions = [position for g in groups for position in g[3]]
+        names = [name for g in groups for name in g[4]]
+        n_agents = len(shapes)
+
+        # Somme delle correzioni di ogni agente, nell'ordine in cui le coppie vengono visitate
+        total_velocity = np.zeros((n_agents, 3))
+        total_separation = np.zeros((n_agents, 3))
+        velocity_counts = np.zeros(n_agents, dtype=np.intp)
+        separation_counts = np.zeros(n_agents, dtype=np.intp)
+        debug_logs = [[] for _ in range(n_agents)]
+        if self.collisions and n_agents:
+            agents_arrays = ShapeArrays(shapes, positions, vectors)
+            rows, targets, with_object = self.candidate_pairs(groups, shapes, positions, names)
+            hit, velocity, has_separation, separation = self.narrowphase(
+                agents_arrays, velocities, vectors, positions, shapes, rows, targets, with_object)
+            np.add.at(total_velocity, rows[hit], velocity[hit])
+            np.add.at(total_separation, rows[has_separation], separation[has_separation])
+            velocity_counts = np.bincount(rows[hit], minlength=n_agents)
+            separation_counts = np.bincount(rows[has_separation], minlength=n_agents)
+            if DEBUG_MODE:
+                for p in np.flatnonzero(has_separation).tolist():
+                    if with_object[p]:
+                        entry = f"  - OBJECT COLLISION at {self.object_positions[targets[p]]}:"
+                    else:
+                        entry = f"  - AGENT COLLISION with '{names[targets[p]]}':"
+                    debug_logs[rows[p]].extend((
+                        entry,
+                        f"    - Velocity Proj.: {Vector3D(*velocity[p].tolist())}",
+                        f"    - Separation Vec.: {Vector3D(*separation[p].tolist())}"
+                    ))
+
+        static_corrections = [None] * n_agents
+        if self.field is not None and n_agents:
+            static_corrections = self.static_corrections(shapes, velocities, vectors, positions)
+
+        out = {}
+        n = 0
+        for k, g in agents.items():
+            out_tmp = [None] * len(g[0])
+            for m in range(len(out_tmp)):
+                out_tmp[m] = self.correct(shapes[n], velocities[n], vectors[n], positions[n], names[n],
+                                          _total(total_velocity, velocity_counts, n),
+                                          _total(total_separation, separation_counts, n),
+                                          debug_logs[n], static_corrections[n])
+                n += 1
+            out[k] = out_tmp
+        return out
+
+    def candidate_pairs(self, groups, shapes, positions, names):
+        """Agent and target indices of the broadphase pairs, in the order of the all-pairs loop.
+
+        Each agent is followed by the other agents in its neighbouring cells, then by the objects
+        unless the static field covers them.
+        """
+        agent_grid, max_agent_radius = CollisionDetector.build_grid([(g[0], g[3]) for g in groups])
+        agent_offsets = np.cumsum([0] + [len(g[0]) for g in groups])
+        rows, targets, with_object = [], [], []
+        for n, shape in enumerate(shapes):
+            position, name = positions[n], names[n]
+            for g, m in sorted(agent_grid.candidates(position, bounding_radius(shape) + max_agent_radius)):
+                target = int(agent_offsets[g]) + m
+                if names[target] == name: continue
+                rows.append(n)
+                targets.append(target)
+                with_object.append(False)
+            if self.field is not None or not self.object_grid.grid: continue
+            for g, m in sorted(self.object_grid.candidates(position, bounding_radius(shape) + self.max_object_radius)):
+                rows.append(n)
+                targets.append(int(self.object_offsets[g]) + m)
+                with_object.append(True)
+        return (np.array(rows, dtype=np.intp), np.array(targets, dtype=np.intp), np.array(with_object, dtype=bool))
+
+    def narrowphase(self, agents_arrays, velocities, vectors, positions, shapes, rows, targets, with_object):
+        """Velocity projection and separation of every candidate pair that collides.
+
+        Circle-circle pairs are computed as arrays, any other pair through the shapes.
+        """
+        n_pairs = len(rows)
+        hit = np.zeros(n_pairs, dtype=bool)
+        has_separation = np.zeros(n_pairs, dtype=bool)
+        velocity = np.zeros((n_pairs, 3))
+        separation = np.zeros((n_pairs, 3))
+        for objects, target_arrays in ((False, agents_arrays), (True, self.object_arrays)):
+            pairs = np.flatnonzero(with_object == objects)
+            circular = agents_arrays.circular[rows[pairs]] & target_arrays.circular[targets[pairs]]
+            batch = pairs[circular]
+            if len(batch):
+                results = _circle_pairs(agents_arrays, target_arrays, rows[batch], targets[batch], np.array(velocities, dtype=float), objects)
+                hit[batch], velocity[batch], has_separation[batch], separation[batch] = results
+            for p in pairs[~circular].tolist():
+                n, target = rows[p], targets[p]
+                if objects:
+                    dshape, dposition, dforward_vector = self.object_shapes[target], self.object_positions[target], None
+                else:
+                    dshape, dposition, dforward_vector = shapes[target], positions[target], vectors[target]
+                result = _pair_correction(shapes[n], velocities[n], vectors[n], positions[n], dshape, dposition, dforward_vector)
+                if result is not None:
+                    hit[p] = True
+                    velocity[p] = (result[0].x, result[0].y, result[0].z)
+                    if result[1] is not None:
+                        has_separation[p] = True
+                        separation[p] = (result[1].x, result[1].y, result[1].z)
+        return hit, velocity, has_separation, separation
+
+    def static_corrections(self, shapes, velocities, vectors, positions):
+        """Velocity projection and separation of each agent against the static field, None where it is clear of it.
+
+        An agent, taken as a disc, collides when the distance at its position is below its radius;
+        it is pushed along the gradient of the field by a tenth of the penetration.
+        """
+        xs = np.array([position.x for position in positions], dtype=float)
+        ys = np.array([position.y for position in positions], dtype=float)
+        radii = np.array([footprint_radius(shape) for shape in shapes], dtype=float)
+        distance, gradient_x, gradient_y = self.field.sample(xs, ys)
+        norm = np.hypot(gradient_x, gradient_y)
+        safe_norm = np.where(norm > 0, norm, 1.0)
+        normal_x = np.where(norm > 0, gradient_x / safe_norm, 0.0).tolist()
+        normal_y = np.where(norm > 0, gradient_y / safe_norm, 0.0).tolist()
+        penetration = (radii - distance).tolist()
+        corrections = [None] * len(shapes)
+        for n in np.flatnonzero(radii > distance).tolist():
+            normal = Vector3D(normal_x[n], normal_y[n], 0.0)
+            corrections[n] = (normal * velocities[n] - vectors[n], normal * penetration[n] * 0.1)
+        return corrections
+
+    def correct(self, shape, max_velocity, forward_vector, position, name, total_velocity_projection, total_separation_vector, debug_log, static_correction=None):
+        """Adds the arena border collision (or the static field one) to the pair corrections and returns the corrected position, or None."""
+        collision_detected = total_velocity_projection is not None
+        if total_velocity_projection is None:
+            total_velocity_projection = Vector3D()
+        if total_separation_vector is None:
+            total_separation_vector = Vector3D()
+
+        # --- Collisions with arena borders and objects, through the static field ---
+        if self.field is not None:
+            if static_correction is not None:
+                collision_detected = True
+                velocity_projection, separation = static_correction
+                total_velocity_projection.iadd(velocity_projection)
+                total_separation_vector.iadd(separation)
+                if DEBUG_MODE:
+                    debug_log.append("  - STATIC COLLISION:")
+                    debug_log.append(f"    - Velocity Proj.: {velocity_projection}")
+                    debug_log.append(f"    - Separation Vec.: {separation}")
+        else:
+            # --- Collisions with arena borders ---
+            overlap = shape.check_overlap(self.arena_shape)
+            if overlap[0]:
+                collision_detected = True
+                velocity_projection = get_collision_normal(overlap[1], self.arena_shape, max_velocity) - forward_vector
+                total_velocity_projection.iadd(velocity_projection)
+            
+                delta_arena = Vector3D(overlap[1].x, overlap[1].y, 0)
+                separation = delta_arena.normalize() * -0.01
+                total_separation_vector.iadd(separation)
+                if DEBUG_MODE:
+                    debug_log.append("  - ARENA BORDER COLLISION:")
+                    debug_log.append(f"    - Velocity Proj.: {velocity_projection}")
+                    debug_log.append(f"    - Separation Vec.: {separation}")
+
+        # --- Applica le correzioni e stampa il report di debug se necessario ---
+        if not collision_detected:
+            return None
+        final_position = position + total_velocity_projection + total_separation_vector
+        if DEBUG_MODE:
+            print(f"\n--- DEBUG: Collision Detected for Agent '{name}' ---")
+            print(f"Initial Position: {position}")
+            print(f"Initial Vector:   {forward_vector}")
+            # Stampa i dettagli delle singole collisioni
+            for log_entry in debug_log:
+                print(log_entry)
+            print("-------------------------------------------------")
+            print(f"Total Velocity Projection: {total_velocity_projection}")
+            print(f"Total Separation Vector:   {total_separation_vector}")
+            print(f"FINAL Calculated Position: {final_position}")
+            print("-------------------------------------------------")
+        return final_position
+
+
+def bounding_radius(shape) -> float:
+    """Radius of a circle around the center of shape containing its footprint: its own radius, or its bounds corner."""
+    radius = shape.get_radius()
+    if radius > 0:
+        return radius
+    (lo_x, lo_y, _), (hi_x, hi_y, _) = shape.bounds()
+    return math.hypot(max(shape.center.x - lo_x, hi_x - shape.center.x), max(shape.center.y - lo_y, hi_y - shape.center.y))
+
+class ShapeArrays:
+    """Positions, circle footprints and bounds of a list of shapes, as arrays."""
+    def __init__(self, shapes, positions, vectors=None):
+        self.positions = np.array([(p.x, p.y, p.z) for p in positions], dtype=float).reshape(-1, 3)
+        self.centers = np.array([(s.center.x, s.center.y, s.center.z) for s in shapes], dtype=float).reshape(-1, 3)
+        self.radii = np.array([s.get_radius() for s in shapes], dtype=float)
+        self.circular = np.array([isinstance(s, Cylinder) for s in shapes], dtype=bool)
+        self.circle_normal = np.array([getattr(s, "_id", None) == "circle" for s in shapes], dtype=bool)
+        bounds = [s.bounds() for s in shapes]
+        self.min_bounds = np.array([b[0] for b in bounds], dtype=float).reshape(-1, 3)
+        self.max_bounds = np.array([b[1] for b in bounds], dtype=float).reshape(-1, 3)
+        if vectors is not None:
+            self.vectors = np.array([(v.x, v.y, v.z) for v in vectors], dtype=float).reshape(-1, 3)
+
+
+def _total(totals, counts, n):
+    """Row n of the summed corrections as a Vector3D, None when nothing was added to it."""
+    if counts[n] == 0:
+        return None
+    x, y, z = totals[n].tolist()
+    return Vector3D(x, y, z)
+
+def _magnitude(vectors):
+    """Vector3D.magnitude of each row: float_power squares through pow() like x**2 does."""
+    squares = np.float_power(vectors, 2)
+    return np.sqrt(squares[:, 0] + squares[:, 1] + squares[:, 2])
+
+def _circle_pairs(agents, targets, rows, cols, velocities, objects):
+    """The per-pair collision response of the detector for circular agents and targets, as arrays."""
+    delta = agents.positions[rows] - targets.positions[cols]
+    distance = _magnitude(delta)
+    radius, target_radius = agents.radii[rows], targets.radii[cols]
+    sum_radius = radius + target_radius
+
+    # Shape.check_overlap of two circles: midpoint of their overlap along the line between the centres
+    centers, target_centers = agents.centers[rows], targets.centers[cols]
+    dx = target_centers[:, 0] - centers[:, 0]
+    dy = target_centers[:, 1] - centers[:, 1]
+    center_distance = np.sqrt(dx * dx + dy * dy)
+    hit = (distance <= sum_radius) & (center_distance <= sum_radius)
+    apart = center_distance > 0
+    safe_distance = np.where(apart, center_distance, 1.0)
+    ux = np.where(apart, dx / safe_distance, 1.0)
+    uy = np.where(apart, dy / safe_distance, 0.0)
+    t = (np.maximum(-radius, center_distance - target_radius) + np.minimum(radius, center_distance + target_radius)) * 0.5
+    contact = np.stack((centers[:, 0] + ux * t, centers[:, 1] + uy * t, centers[:, 2]), axis=1)
+
+    # get_collision_normal
+    max_velocity = velocities[rows]
+    reversed_contact = -contact
+    magnitude = _magnitude(reversed_contact)
+    safe_magnitude = np.where(magnitude == 0, 1.0, magnitude)[:, None]
+    circle_normal = np.where((magnitude == 0)[:, None], 0.0, reversed_contact / safe_magnitude) * max_velocity[:, None]
+    min_bounds, max_bounds = targets.min_bounds[cols], targets.max_bounds[cols]
+    wall = np.argmin(np.stack((
+        np.abs(contact[:, 0] - min_bounds[:, 0]),
+        np.abs(contact[:, 0] - max_bounds[:, 0]),
+        np.abs(contact[:, 1] - min_bounds[:, 1]),
+        np.abs(contact[:, 1] - max_bounds[:, 1])
+    ), axis=1), axis=1)
+    wall_normal = np.zeros((len(rows), 3))
+    wall_normal[:, 0] = np.select([wall == 0, wall == 1], [1.0, -1.0], 0.0)
+    wall_normal[:, 1] = np.select([wall == 2, wall == 3], [1.0, -1.0], 0.0)
+    wall_normal *= max_velocity[:, None]
+    normal = np.where(targets.circle_normal[cols][:, None], circle_normal, wall_normal)
+
+    velocity = normal - agents.vectors[rows]
+    if not objects:
+        velocity = velocity + targets.vectors[cols]
+    has_separation = hit & (distance > 0)
+    penetration_depth = sum_radius - distance
+    safe_distance = np.where(distance > 0, distance, 1.0)[:, None]
+    separation = (delta / safe_distance) * penetration_depth[:, None] * 0.1
+    return hit, velocity, has_separation, separation
+
+def _pair_correction(shape, max_velocity, forward_vector, position, dshape, dposition, dforward_vector):
+    """(velocity projection, separation or None) of a colliding pair of shapes, None if they do not collide.
+
+    dforward_vector is None for objects.
+    """
+    delta = position - dposition
+    sum_radius = shape.get_radius() + dshape.get_radius()
+    if delta.magnitude() > sum_radius:
+        return None
+    overlap = shape.check_overlap(dshape)
+    if not overlap[0]:
+        return None
+    velocity_projection = get_collision_normal(overlap[1], dshape, max_velocity) - forward_vector
+    if dforward_vector is not None:
+        velocity_projection = velocity_projection + dforward_vector
+    separation = None
+    if delta.magnitude() > 0:
+        penetration_depth = sum_radius - delta.magnitude()
+        separation = delta.normalize() * penetration_depth * 0.1
+    return velocity_projection, separation
     
 
 def get_collision_normal(collision_point: Vector3D, shape, max_absolute_velocity: float) -> Vector3D:
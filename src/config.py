@@ -137,6 +137,9 @@ class Config:
                     experiment = {
                         "environment": {
                             "collisions": environment.get("collisions", False),
+                            "collision_field_resolution": environment.get("collision_field_resolution", 0),
+                            "collision_mode": environment.get("collision_mode", "process"),
+                            "state_transport": environment.get("state_transport", "queue"),
                             "parallel_experiments": environment.get("parallel_experiments", False),
                             "ticks_per_second": environment.get("ticks_per_second", 10),
                             "time_limit": environment.get("time_limit", 0),
@@ -3,7 +3,9 @@ import numpy as np
 from random import Random
 from geometry_utils.vector3D import Vector3D
 from bodies.shapes3D import Shape3DFactory
-from spinsystem import SpinSystem
+from spinsystem import SpinSystem, RingCoupling
+from perception import PerceptionKernels
+from agentstate import AgentStateStore, state_property
 
 _PI = math.pi
 class EntityFactory:
@@ -317,8 +319,18 @@ class MovableAgent(StaticAgent):
     LEFT    = 2
     RIGHT   = 3
 
+    position = state_property("position")
+    orientation = state_property("orientation")
+    forward_vector = state_property("forward_vector")
+    prev_position = state_property("prev_position")
+    prev_orientation = state_property("prev_orientation")
+    delta_orientation = state_property("delta_orientation")
+
     def __init__(self,entity_type:str, config_elem:dict,_id:int=0):
+        # own one row state until EntityManager gathers the population in a shared store
+        self.attach_state(AgentStateStore(1), 0)
         super().__init__(entity_type,config_elem,_id)
+        self.deferred_integration = False
         self.config_elem = config_elem
         self.max_absolute_velocity = float(config_elem.get("linear_velocity",0.01)) / self.ticks_per_second
         self.max_angular_velocity = int(config_elem.get("angular_velocity",360)) / self.ticks_per_second
@@ -331,6 +343,9 @@ class MovableAgent(StaticAgent):
         self.detection = config_elem.get("detection","GPS")
         self.moving_behavior = config_elem.get("moving_behavior","random_walk")
         self.pre_run = False
+        self.pre_run_cache = None
+        self.batched_vision = False
+        self.batched_perception = False
 
 
         # we define the number of bins of visual filed(angular resolution)
@@ -367,17 +382,40 @@ class MovableAgent(StaticAgent):
             self.spin_pre_run_steps = self.spin_model_params.get("spin_pre_run_steps",0)
             self.pre_run = True if self.spin_pre_run_steps > 0 else False
             self.spin_per_tick = self.spin_model_params.get("spin_per_tick", 3)
+            self.adaptive_spins = bool(self.spin_model_params.get("adaptive_spins", False))
+            self.spin_per_tick_min = int(self.spin_model_params.get("spin_per_tick_min", 1))
+            self.spin_per_tick_max = int(self.spin_model_params.get("spin_per_tick_max", 4 * self.spin_per_tick))
+            self.convergence_window = int(self.spin_model_params.get("convergence_window", 32))
+            self.convergence_tolerance = float(self.spin_model_params.get("convergence_tolerance", 0.01))
+            self.perception_change = float(self.spin_model_params.get("perception_change", 0.25))
+            self.prev_perception = None
+            self.spin_steps = 0
             self.perception_width = self.spin_model_params.get("perception_width",0.5)
             self.num_groups = self.spin_model_params.get("num_groups",32)
             self.num_spins_per_group = self.spin_model_params.get("num_spins_per_group",10)
             self.perception_global_inhibition = self.spin_model_params.get("perception_global_inhibition",0)
             self.reference = self.spin_model_params.get("reference","egocentric")
             self.group_angles = np.linspace(0, 2 * _PI, self.num_groups, endpoint=False)
+            self.perception_kernels = PerceptionKernels.shared(
+                self.num_groups,
+                self.perception_width,
+                float(self.spin_model_params.get("perception_tolerance", 0.0))
+            )
+            self.ring_coupling = RingCoupling.shared(
+                self.num_groups,
+                self.num_spins_per_group,
+                float(self.spin_model_params.get("nu",0)),
+                self.spin_model_params.get("coupling","auto"),
+                bool(self.spin_model_params.get("shared_memory",False))
+            )
         elif self.moving_behavior == "vision":
             vm = config_elem.get("vision_model", {})
             self.visual_bins = vm.get("visual_bins", 72)
             self.body_length = vm.get("body_length", 0.1)
             self.visual_mode = vm.get("visual_mode", "binary")
+            self.perception_radius = float(vm.get("perception_radius", 2.0))
+            self.perception_grid = None
+            self.perception_margin = 0.0
         
             self.alpha0 = float(vm.get("alpha0", 1.0))
             self.alpha1 = float(vm.get("alpha1", 0.0))
@@ -400,6 +438,30 @@ class MovableAgent(StaticAgent):
 
     """ OUR PROJECT"""
     
+    def set_perception_grid(self, grid, margin):
+        """Grid of the agents positions at the start of the tick; margin bounds how far they moved since."""
+        self.perception_grid = grid
+        self.perception_margin = margin
+
+    @staticmethod
+    def covered_bins(angles, rel_angles, half_angles):
+        """(targets, bins) mask of the bins whose wrapped distance from each target direction is within its half angle."""
+        diff = np.abs(((angles[None, :] - rel_angles[:, None] + math.pi) % (2 * math.pi)) - math.pi)
+        return diff <= half_angles[:, None]
+
+    def relative_targets(self, xs, ys, my_orient_rad, size):
+        """Distance, egocentric bearing and angular half size of the targets at xs, ys."""
+        px, py, _ = self.state_store.arrays["position"][self.state_row].tolist()
+        dist, rel_angles, half_angles = [], [], []
+        for x, y in zip(xs, ys):
+            dx = x - px
+            dy = y - py
+            d = math.hypot(dx, dy)
+            dist.append(d)
+            rel_angles.append(((math.atan2(-dy, dx) - my_orient_rad) + math.pi) % (2 * math.pi) - math.pi)
+            half_angles.append(math.pi if d <= 1e-9 else math.atan((size / 2.0) / d))
+        return np.array(dist), np.array(rel_angles), np.array(half_angles)
+
     def build_visual_field(self, objects, all_entities):
         """
         Restituisce V(φ) discretizzato. Ora include sia oggetti che altri agenti.
@@ -408,63 +470,44 @@ class MovableAgent(StaticAgent):
         V = np.zeros(N, dtype=float)
         angles = np.linspace(-math.pi, math.pi, N, endpoint=False)
         bin_width = 2 * math.pi / N
-        my_orient_rad = math.radians(self.orientation.z)
-    
-        # --- PRIMO LOOP: Processa gli OGGETTI STATICI (come prima) ---
-        for _, (shapes, positions, strengths, uncertainties) in objects.items():
-            for n in range(len(positions)):
-                pos = positions[n]
-                dx = pos.x - self.position.x
-                dy = pos.y - self.position.y
-                dist = math.hypot(dx, dy)
-                angle_global = math.atan2(-dy, dx)
-                rel_angle = ((angle_global - my_orient_rad) + math.pi) % (2 * math.pi) - math.pi
-                BL = max(1e-6, self.body_length)
-                if dist <= 1e-9: half_angle = math.pi
-                else: half_angle = math.atan((BL / 2.0) / dist)
-                for k, phi_k in enumerate(angles):
-                    diff = abs(((phi_k - rel_angle + math.pi) % (2*math.pi)) - math.pi)
-                    if diff <= half_angle:
-                        if self.visual_mode == "binary": V[k] = 1.0
-                        else: V[k] += 2.0 * half_angle
-    
-        # --- SECONDO LOOP: Processa gli ALTRI AGENTI (CORRETTO) ---
-        for other_agent in all_entities:
-            # Salta se l'entità sono io stesso
-            if other_agent is self:
-                continue
-            
-            pos = other_agent.get_position()
-            dx = pos.x - self.position.x
-            dy = pos.y - self.position.y
-            dist = math.hypot(dx, dy)
-    
-            # Se un agente è troppo lontano, ignoralo per performance
-            if dist > 2.0: # Puoi regolare questa "distanza di percezione"
-                continue
-    
-            angle_global = math.atan2(-dy, dx)
-            rel_angle = ((angle_global - my_orient_rad) + math.pi) % (2 * math.pi) - math.pi
-            
-            # Per la repulsione, usiamo il diametro fisico dell'agente per calcolare la sua dimensione apparente
+        my_orient_rad = math.radians(self.state_store.arrays["orientation"].item(self.state_row, 2))
+
+        # --- Oggetti statici: ognuno copre i bin entro la sua semi-ampiezza angolare ---
+        positions = [pos for (_, obj_positions, _, _) in objects.values() for pos in obj_positions]
+        if positions:
+            xs, ys = [pos.x for pos in positions], [pos.y for pos in positions]
+            _, rel_angles, half_angles = self.relative_targets(xs, ys, my_orient_rad, max(1e-6, self.body_length))
+            covered = self.covered_bins(angles, rel_angles, half_angles)
+            if self.visual_mode == "binary":
+                V[covered.any(axis=0)] = 1.0
+            else:
+                V = np.where(covered, 2.0 * half_angles[:, None], 0.0).sum(axis=0)
+
+        # --- Altri agenti: trattati come ostacoli, V = 1.0 sui bin coperti ---
+        if self.perception_grid is not None:
+            all_entities = self.perception_grid.candidates(self.position, self.perception_radius + self.perception_margin)
+        others = [other_agent for other_agent in all_entities if other_agent is not self]
+        if others:
+            positions = AgentStateStore.columns(others, "position")
+            xs, ys = positions[:, 0].tolist(), positions[:, 1].tolist()
+            # per la repulsione si usa il diametro fisico dell'agente come dimensione apparente
             agent_diameter = self.shape.diameter if hasattr(self.shape, 'diameter') else 0.033
-            BL = max(1e-6, agent_diameter)
-            
-            if dist <= 1e-9: half_angle = math.pi
-            else: half_angle = math.atan((BL / 2.0) / dist)
-    
-            for k, phi_k in enumerate(angles):
-                diff = abs(((phi_k - rel_angle + math.pi) % (2*math.pi)) - math.pi)
-                if diff <= half_angle:
-                    # Tratta gli altri agenti come ostacoli, quindi imposta V a 1.0
-                    V[k] = 1.0
-        
+            dist, rel_angles, half_angles = self.relative_targets(xs, ys, my_orient_rad, max(1e-6, agent_diameter))
+            near = dist <= self.perception_radius
+            V[self.covered_bins(angles, rel_angles[near], half_angles[near]).any(axis=0)] = 1.0
+
         if self.visual_mode == "binary":
             V = np.minimum(V, 1.0)
-    
+
         return V, angles, bin_width
         
     
+    def apply_vision_update(self, V, speed, delta_angle_deg):
+        """Store the visual field, then apply the new speed and the heading change of eq. (3)/(4)."""
+        self.prev_visual_field = V.copy()
+        self.speed = speed
+        self.turn(delta_angle_deg, self.speed)
+
     def vision_routine(self, tick, arena_shape, objects, all_entities):
         """
         Implementazione discreta delle eq. (3) e (4) del paper.
@@ -480,9 +523,6 @@ class MovableAgent(StaticAgent):
         # 2) calcolo ∂φ V discretamente (gradient)
         dV_dphi = np.gradient(V, bin_width)   # ∂φ V (in unità di V per rad)
 
-        # salvo per il passo successivo
-        self.prev_visual_field = V.copy()
-
         # 4) costruisco integrandi per eq. (3) (accelerazione) e (4) (virata)
         # integrand_acc(φ) = cos(φ) * α0 * ( -V + α1*(∂φV)^2 + α2 * ∂tV )
         # integrand_turn(φ) = sin(φ) * β0 * ( -V + β1*(∂φV)^2 + β2 * ∂tV )
@@ -519,23 +559,15 @@ class MovableAgent(StaticAgent):
         # max_allowed_speed = getattr(self, "max_speed", self.max_absolute_velocity * 3.0)
         #new_speed = min(new_speed, max_allowed_speed)
         
-        self.speed = new_speed
-
-        # 11) aggiorna orientazione (attenzione: orientation.z è in gradi nel tuo codice)
-        delta_angle_deg = math.degrees(dpsi_dt * dt)   # dpsi_dt è rad/s -> moltiplico per dt -> rad -> converto in deg
-        self.delta_orientation = Vector3D(0, 0, delta_angle_deg)
-        self.orientation = self.orientation + self.delta_orientation
-        self.orientation.z = normalize_angle(self.orientation.z)  # mantiene in [-180,180]
-
-        # 12) aggiorna forward_vector coerente con speed e orientazione
-        ang_rad = math.radians(self.orientation.z)
-        scaling_factor = 1.0 
-        self.forward_vector = (Vector3D(self.speed *scaling_factor* math.cos(ang_rad),self.speed *scaling_factor* -math.sin(ang_rad),0))
+        # 11)-12) aggiorna orientazione e forward_vector
+        self.apply_vision_update(V, new_speed, math.degrees(dpsi_dt * dt))   # dpsi_dt è rad/s -> moltiplico per dt -> rad -> converto in deg
         print(self.forward_vector)
 
     def reset(self):
         if self.moving_behavior == "spin_model":
             self.perception = None
+            self.batched_spins = False
+            self.prev_perception = None
             self.spin_system = SpinSystem(
                 self.random_generator,
                 self.num_groups,
@@ -545,7 +577,9 @@ class MovableAgent(StaticAgent):
                 float(self.spin_model_params.get("nu",0)),
                 float(self.spin_model_params.get("p_spin_up",0.5)),
                 int(self.spin_model_params.get("time_delay",1)),
-                self.spin_model_params.get("dynamics","metropolis")
+                self.spin_model_params.get("dynamics","metropolis"),
+                ring_coupling=self.ring_coupling,
+                rng_mode=self.spin_model_params.get("rng","numpy")
             )
         else:
             self.turning_ticks = 0
@@ -553,6 +587,10 @@ class MovableAgent(StaticAgent):
             self.motion = MovableAgent.STOP
             self.last_motion_tick = 0
 
+    def attach_spin_batch(self, batch, index):
+        self.spin_system = batch.view(index)
+        self.batched_spins = True
+
     def get_spin_system_data(self):
         if self.moving_behavior == "spin_model":
             return self.spin_system.get_states(),self.spin_system.get_angles(),self.spin_system.get_external_field(),self.spin_system.get_avg_direction_of_activity()
@@ -598,14 +636,16 @@ class MovableAgent(StaticAgent):
                 self.turning_ticks = int(angle * self.max_turning_ticks)
 
     def random_way_point(self, arena_shape):
-        if self.goal_position is None or (self.position - self.goal_position).magnitude() <= .001:
-            self.goal_position = self.shape._get_random_point_inside_shape(self.random_generator, arena_shape)
-        dx = self.goal_position.x - self.position.x
-        dy = self.goal_position.y - self.position.y
+        arrays, row = self.state_store.arrays, self.state_row
+        px, py, pz = arrays["position"][row].tolist()
+        goal = self.goal_position
+        if goal is None or math.sqrt((px - goal.x)**2 + (py - goal.y)**2 + (pz - goal.z)**2) <= .001:
+            goal = self.goal_position = self.shape._get_random_point_inside_shape(self.random_generator, arena_shape)
+        dx = goal.x - px
+        dy = goal.y - py
         angle_to_goal = math.degrees(math.atan2(-dy, dx))
-        angle_to_goal = normalize_angle(angle_to_goal - self.orientation.z)
-        distance = self.position - self.goal_position
-        dist_mag = distance.magnitude()
+        angle_to_goal = normalize_angle(angle_to_goal - arrays["orientation"].item(row, 2))
+        dist_mag = math.sqrt((px - goal.x)**2 + (py - goal.y)**2 + (pz - goal.z)**2)
         if abs(dist_mag) >= self.prev_goal_distance:
             self.last_motion_tick += 1
         self.prev_goal_distance = dist_mag
@@ -625,75 +665,128 @@ class MovableAgent(StaticAgent):
             self.shape.translate(self.position)
             self.shape.translate_attachments(self.orientation.z)
     
+    def set_pre_run_cache(self, cache):
+        self.pre_run_cache = cache
+
     def spin_pre_run(self,objects):
         if self.pre_run:
             self.update_detection(objects)
+            key = None
+            if self.pre_run_cache is not None:
+                parameters = {**self.spin_system.parameters(), "spin_pre_run_steps": self.spin_pre_run_steps}
+                key = self.pre_run_cache.key(parameters, self.perception, self.spin_system.get_random_state())
+                cached = self.pre_run_cache.get(key)
+                if cached is not None:
+                    p_spin_up, random_state = cached
+                    self.spin_system.set_random_state(random_state)
+                    self.spin_system.set_p_spin_up(p_spin_up)
+                    self.spin_system.reset_spins()
+                    return
             for _ in range(self.spin_pre_run_steps):
                 self.spin_system.step(timedelay=False)
-            self.spin_system.set_p_spin_up(np.mean(self.spin_system.get_states()))
+            p_spin_up = float(np.mean(self.spin_system.get_states()))
+            if key is not None:
+                self.pre_run_cache.put(key, (p_spin_up, self.spin_system.get_random_state()))
+            self.spin_system.set_p_spin_up(p_spin_up)
             self.spin_system.reset_spins()
 
     def update_detection(self, objects):
-        perception = np.zeros(self.num_groups * self.num_spins_per_group)
         sigma0 = self.perception_width
+        px, py, _ = self.state_store.arrays["position"][self.state_row].tolist()
+        heading = self.state_store.arrays["orientation"].item(self.state_row, 2)
+        bearings, effective_widths, object_strengths = [], [], []
         for _, (shapes, positions, strengths, uncertainties) in objects.items():
             for n in range(len(shapes)):
-                dx = positions[n].x - self.position.x
-                dy = positions[n].y - self.position.y
+                dx = positions[n].x - px
+                dy = positions[n].y - py
                 angle_to_object = math.degrees(math.atan2(-dy, dx))
                 if self.reference == "egocentric":
-                    angle_to_object = angle_to_object - self.orientation.z
-                angle_to_object = normalize_angle(angle_to_object)
-                effective_width = sigma0 + uncertainties[n]
-                angle_diffs = np.abs(self.group_angles - math.radians(angle_to_object))
-                angle_diffs = np.minimum(angle_diffs, 2 * _PI - angle_diffs)
-                sigma = max(effective_width, 1e-6)
-                weights = (sigma0 / sigma) * np.exp(-(angle_diffs ** 2) / (2 * (sigma ** 2)))
-                weights *= strengths[n]
-                perception += np.repeat(weights, self.num_spins_per_group)
-        perception -= self.perception_global_inhibition
-        self.perception = perception
+                    angle_to_object = angle_to_object - heading
+                bearings.append(math.radians(normalize_angle(angle_to_object)))
+                effective_widths.append(sigma0 + uncertainties[n])
+                object_strengths.append(strengths[n])
+        weights = self.perception_kernels.weights(bearings, effective_widths, object_strengths)
+        self.perception = np.repeat(weights, self.num_spins_per_group) - self.perception_global_inhibition
 
     def run(self,tick,arena_shape,objects,all_entities):
-        if self.detection == "visual":
-            self.vision_routine(tick,arena_shape,objects,all_entities)
+        if self.moving_behavior == "spin_model":
+            self.spins_routine(objects)
+        elif self.detection == "visual":
+            if not self.batched_vision:
+                self.vision_routine(tick,arena_shape,objects,all_entities)
         elif self.detection == "GPS":
             self.GPS_routine(tick,arena_shape)
-        dt = 1.0/self.ticks_per_second
-        self.position = self.position + self.forward_vector*dt
+        if not self.deferred_integration:
+            dt = 1.0/self.ticks_per_second
+            self.position = self.position + self.forward_vector*dt
+            self.update_shape()
+
+    def attach_state(self, store, row):
+        self.state_store = store
+        self.state_row = row
+
+    # The routines below run every tick and work on the store row directly: each read of the
+    # position, orientation or forward_vector properties builds a new Vector3D.
+    def store_previous(self):
+        """prev_position and prev_orientation <- position and orientation."""
+        arrays, row = self.state_store.arrays, self.state_row
+        arrays["prev_position"][row] = arrays["position"][row]
+        arrays["prev_orientation"][row] = arrays["orientation"][row]
+
+    def turn(self, delta_z:float, speed:float) -> float:
+        """Turn the heading by delta_z degrees and move forward along it at speed; returns the new heading."""
+        arrays, row = self.state_store.arrays, self.state_row
+        arrays["delta_orientation"][row] = (0.0, 0.0, delta_z)
+        heading = normalize_angle(arrays["orientation"].item(row, 2) + delta_z)
+        arrays["orientation"][row, 2] = heading
+        angle_rad = math.radians(heading)
+        arrays["forward_vector"][row] = (speed * math.cos(angle_rad), speed * -math.sin(angle_rad), 0.0)
+        return heading
+
+    def update_shape(self):
         self.shape.rotate(self.delta_orientation.z)
         self.shape.translate(self.position)
         self.shape.translate_attachments(self.orientation.z)
 
+    def perception_changed(self):
+        """True when the perception moved by more than perception_change (relative L1) since the previous tick."""
+        prev, self.prev_perception = self.prev_perception, np.array(self.perception, copy=True)
+        if prev is None:
+            return True
+        reference = np.abs(prev).sum()
+        change = np.abs(self.perception - prev).sum()
+        return change > self.perception_change * reference if reference > 0 else change > 0
+
     def spins_routine(self, objects):
-        self.prev_position = self.position
-        self.prev_orientation = self.orientation
-        self.update_detection(objects)
-        self.spin_system.update_external_field(self.perception)
-        self.spin_system.run_spins(steps=self.spin_per_tick)
+        self.store_previous()
+        self.state_store.arrays["delta_orientation"][self.state_row] = 0.0
+        if not self.batched_spins:
+            if not self.batched_perception:
+                self.update_detection(objects)
+                self.spin_system.update_external_field(self.perception)
+            if self.adaptive_spins:
+                self.spin_steps = self.spin_system.run_spins_adaptive(
+                    min(self.spin_per_tick_min, self.spin_per_tick),
+                    self.spin_per_tick_max if self.perception_changed() else self.spin_per_tick,
+                    self.convergence_window,
+                    self.convergence_tolerance
+                )
+            else:
+                self.spin_system.run_spins(steps=self.spin_per_tick)
+                self.spin_steps = self.spin_per_tick
         angle_rad = self.spin_system.average_direction_of_activity()
         if angle_rad is not None:
             if self.reference == "allocentric":
-                angle_rad = angle_rad - math.radians(self.orientation.z)
+                angle_rad = angle_rad - math.radians(self.state_store.arrays["orientation"].item(self.state_row, 2))
             angle_deg = normalize_angle(math.degrees(angle_rad))
             angle_deg = max(min(angle_deg, self.max_angular_velocity), -self.max_angular_velocity)
-            self.delta_orientation = Vector3D(0, 0, angle_deg)
-            self.orientation = self.orientation + self.delta_orientation
-            self.orientation.z = normalize_angle(self.orientation.z)
-            angle_rad = math.radians(self.orientation.z)
             width = self.spin_system.get_width_of_activity()
             scaling_factor = 1.0 / width if width and width > 0 else 0.0
             print("!!!!!!!!!!!!!!!!!!!!!!!!!!!")
             print(f"sto stampando width {width}")
             print(f"sto stampando scaling_factor {scaling_factor}")
             scaling_factor = np.clip(scaling_factor, 0.0, 1.0)
-            cos_angle = math.cos(angle_rad)
-            sin_angle = math.sin(angle_rad)
-            self.forward_vector = Vector3D(
-                self.max_absolute_velocity * scaling_factor * cos_angle,
-                self.max_absolute_velocity * scaling_factor * -sin_angle,
-                0
-            )
+            self.turn(angle_deg, self.max_absolute_velocity * scaling_factor)
 
     def GPS_routine(self, tick, arena_shape):
         print(f"TICK {tick}: Agente {self.get_name()} sta usando >>> GPS_ROUTINE <<<")
@@ -703,23 +796,13 @@ class MovableAgent(StaticAgent):
             self.random_way_point(arena_shape)
         else:
             raise ValueError(f"Invalid moving behavior: {self.moving_behavior}")
-        self.prev_position = self.position
-        self.prev_orientation = self.orientation
-        self.delta_orientation = Vector3D(0, 0, 0)
+        self.store_previous()
+        delta_z = 0
         if self.motion == MovableAgent.LEFT:
-            self.delta_orientation.z = self.max_angular_velocity
+            delta_z = self.max_angular_velocity
         elif self.motion == MovableAgent.RIGHT:
-            self.delta_orientation.z = -self.max_angular_velocity
-        self.orientation = self.orientation + self.delta_orientation
-        self.orientation.z = normalize_angle(self.orientation.z)
-        angle_rad = math.radians(self.orientation.z)
-        cos_angle = math.cos(angle_rad)
-        sin_angle = math.sin(angle_rad)
-        self.forward_vector = Vector3D(
-            self.max_absolute_velocity * cos_angle,
-            self.max_absolute_velocity * -sin_angle,
-            0
-        )
+            delta_z = -self.max_angular_velocity
+        self.turn(delta_z, self.max_absolute_velocity)
     
     def close(self):
         return super().close()
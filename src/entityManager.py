@@ -1,16 +1,34 @@
 import multiprocessing as mp
 from messagebus import MessageBus
+from spinsystem import BatchedSpinSystem
+from spincache import PreRunCache
+from vision import BatchedVision
+from perception import BatchedPerception
+from spatialgrid import SpatialGrid
+from agentstate import AgentStateStore
 from random import Random
-from geometry_utils.vector3D import Vector3D
+from geometry_utils.vector3D import Vector3D, Vector3DArray
 import csv
 import numpy as np
 import os
 
 class EntityManager:
-    def __init__(self, agents, arena_shape):
+    def __init__(self, agents, arena_shape, results_path:str = "../data/"):
         self.agents = agents
         self.arena_shape = arena_shape
         self.message_buses = {}
+        self.spin_batches = {}
+        self.vision_batches = {}
+        self.perception_batches = {}
+        self.pre_run_caches = {}
+        self.perception_grid = None
+        self.state_store = AgentStateStore.gather([e for (_, entities) in self.agents.values() for e in entities if hasattr(e, "attach_state")])
+        self.deferred_rows = np.zeros(0, dtype=np.intp)
+        self.deferred_entities = []
+        self.inline_collisions = False
+        self.collision_detector = None
+        self.shared_state = None
+        self.state_write = None
         for agent_type, (config,entities) in self.agents.items():
             any_msg_enabled = True if len(config.get("messages",{})) > 0 else False
             if any_msg_enabled:
@@ -21,6 +39,17 @@ class EntityManager:
                         e.set_message_bus(bus)
             else:
                 self.message_buses[agent_type] = None
+            spin_params = config.get("spin_model", {})
+            if config.get("moving_behavior") == "spin_model" and spin_params.get("spin_pre_run_steps", 0) > 0:
+                capacity = int(spin_params.get("pre_run_cache", 0))
+                disk_capacity = int(spin_params.get("pre_run_cache_disk", 0))
+                if capacity > 0 or disk_capacity > 0:
+                    cache_path = os.path.join(os.path.abspath(""), results_path, "pre_run_cache", agent_type)
+                    cache = PreRunCache(capacity, cache_path, disk_capacity)
+                    self.pre_run_caches[agent_type] = cache
+                    for e in entities:
+                        if hasattr(e, "set_pre_run_cache"):
+                            e.set_pre_run_cache(cache)
 
     def initialize(self, random_seed, objects):
         min_v = self.arena_shape.min_vert()
@@ -82,6 +111,140 @@ class EntityManager:
                     entity.set_start_position(Vector3D(position.x, position.y, abs(entity.get_shape().min_vert().z)))
                 entity.shape.translate_attachments(entity.orientation.z)
                 entity.spin_pre_run(objects)
+        self.init_perception_batches()
+        self.init_spin_batches()
+        self.init_vision_batches()
+        self.init_integration()
+
+    def init_spin_batches(self):
+        self.spin_batches = {}
+        for agent_type, (config, entities) in self.agents.items():
+            if not entities or getattr(entities[0], "moving_behavior", None) != "spin_model":
+                continue
+            if not config.get("spin_model", {}).get("batched", False):
+                continue
+            seed = [Random.getrandbits(entity.get_random_generator(), 32) for entity in entities]
+            batch = BatchedSpinSystem([entity.spin_system for entity in entities], seed)
+            for n, entity in enumerate(entities):
+                entity.attach_spin_batch(batch, n)
+            self.spin_batches[agent_type] = batch
+
+    def run_spin_batches(self):
+        for agent_type, batch in self.spin_batches.items():
+            _, entities = self.agents[agent_type]
+            batch.run_spins(steps=entities[0].spin_per_tick)
+
+    def init_perception_batches(self):
+        self.perception_batches = {}
+        for agent_type, (config, entities) in self.agents.items():
+            if not entities or getattr(entities[0], "moving_behavior", None) != "spin_model":
+                continue
+            spin_config = config.get("spin_model", {})
+            # the batched spin engine reads its external fields from the perception batch
+            if not spin_config.get("batched_perception", False) and not spin_config.get("batched", False):
+                continue
+            for entity in entities:
+                entity.batched_perception = True
+            self.perception_batches[agent_type] = BatchedPerception(entities)
+
+    def run_perception_batches(self, objects):
+        if not self.perception_batches:
+            return
+        object_arrays = BatchedPerception.object_arrays(objects)
+        for agent_type, batch in self.perception_batches.items():
+            batch.update(object_arrays, self.spin_batches.get(agent_type))
+
+    def init_vision_batches(self):
+        self.vision_batches = {}
+        sequential = []
+        for agent_type, (config, entities) in self.agents.items():
+            if not entities or getattr(entities[0], "moving_behavior", None) != "vision" or entities[0].detection != "visual":
+                continue
+            if not config.get("vision_model", {}).get("batched", False):
+                sequential.extend(entities)
+                continue
+            for entity in entities:
+                entity.batched_vision = True
+            self.vision_batches[agent_type] = BatchedVision(entities)
+        self.perception_grid = None
+        if sequential:
+            # agents move during the tick loop, the grid is queried with the longest step of a tick as margin
+            margin = max(getattr(e, "max_absolute_velocity", 0.0) / e.ticks() for (_, entities) in self.agents.values() for e in entities)
+            self.perception_grid = SpatialGrid(max(max(e.perception_radius for e in sequential), 1e-6))
+            for entity in sequential:
+                entity.set_perception_grid(self.perception_grid, margin)
+
+    def init_integration(self):
+        # sequential vision agents look at the agents already moved in the same tick: with any of
+        # them around every agent keeps moving inside its run, otherwise all move together after the loop
+        movable = [e for (_, entities) in self.agents.values() for e in entities if hasattr(e, "attach_state")]
+        sequential_vision = any(e.moving_behavior == "vision" and e.detection == "visual" and not e.batched_vision for e in movable)
+        self.deferred_entities = [] if sequential_vision else movable
+        for entity in movable:
+            entity.deferred_integration = not sequential_vision
+        self.deferred_rows = np.array([entity.state_row for entity in self.deferred_entities], dtype=np.intp)
+
+    def set_inline_collisions(self, collision_detector):
+        """Resolve collisions in this process through collision_detector (None: no collisions) instead of the detector queues."""
+        self.inline_collisions = True
+        self.collision_detector = collision_detector
+
+    def resolve_collisions(self, objects) -> dict:
+        """Corrected positions per agent type, as the detector process would send them back."""
+        if self.collision_detector is None:
+            return {}
+        detector_objects = {key: (shapes, positions) for key, (shapes, positions, _, _) in objects.items()}
+        return self.collision_detector.resolve(self.pack_detector_data(), detector_objects)
+
+    def set_shared_state(self, shared_state):
+        """Publish the agents state through shared_state (a SharedAgentState) and only send tick numbers on the queues."""
+        self.shared_state = shared_state
+
+    def pack_agents_data(self, t, ticks_per_second, full:bool=False) -> dict:
+        """Message for the arena: the agents shapes and spins, or the tick and the number of their write in shared_state."""
+        if self.shared_state is not None:
+            self.state_write = self.shared_state.write(self.agents)
+            if not full:
+                return {"status": [t, ticks_per_second], "state_write": self.state_write}
+        return {
+            "status": [t, ticks_per_second],
+            "agents_shapes": self.get_agent_shapes(),
+            "agents_spins": self.get_agent_spins()
+        }
+
+    def integrate_agents(self):
+        if len(self.deferred_rows):
+            self.state_store.integrate(self.deferred_rows)
+            for entity in self.deferred_entities:
+                entity.update_shape()
+
+    def tick_metrics(self, start_positions, start_forward):
+        """Polarization and center of mass as they stand after each agent of the tick has run, in run order."""
+        def unit_vectors(vectors):
+            magnitudes = np.sqrt((vectors ** 2).sum(axis=1))
+            valid = magnitudes > 0
+            units = np.zeros_like(vectors)
+            units[valid] = vectors[valid] / magnitudes[valid, None]
+            return units, valid
+        positions = self.state_store.arrays["position"]
+        start_units, start_valid = unit_vectors(start_forward)
+        units, valid = unit_vectors(self.state_store.arrays["forward_vector"])
+        direction_sums = start_units.sum(axis=0) + np.cumsum(units - start_units, axis=0)
+        counts = start_valid.sum() + np.cumsum(valid.astype(int) - start_valid)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            polarization = np.where(counts > 0, np.linalg.norm(direction_sums / counts[:, None], axis=1), 0.0)
+        centers = (start_positions.sum(axis=0) + np.cumsum(positions - start_positions, axis=0)) / len(positions)
+        return polarization, centers
+
+    def update_perception_grid(self, all_entities):
+        if self.perception_grid is not None:
+            self.perception_grid.clear()
+            for entity in all_entities:
+                self.perception_grid.insert(entity)
+
+    def run_vision_batches(self, objects, all_entities):
+        for batch in self.vision_batches.values():
+            batch.step(objects, all_entities)
 
     ##----- For polarization and center of mass calculator-----
     @staticmethod
@@ -114,6 +277,8 @@ class EntityManager:
             for entity in entities:
                 entity.close()
             self.message_buses.clear()
+        for cache in self.pre_run_caches.values():
+            cache.close()
 
     def run(self, num_runs, time_limit, arena_queue: mp.Queue, agents_queue: mp.Queue, dec_agents_in: mp.Queue, dec_agents_out: mp.Queue, render: bool = False):
         ticks_per_second = 1
@@ -152,12 +317,7 @@ class EntityManager:
                     bus.reset_mailboxes()
                     for _, (_,entities) in self.agents.items():
                         bus.update_grid(entities)
-            agents_data = {
-                "status": [0, ticks_per_second],
-                "agents_shapes": self.get_agent_shapes(),
-                "agents_spins": self.get_agent_spins()
-            }
-            agents_queue.put(agents_data)
+            agents_queue.put(self.pack_agents_data(0, ticks_per_second, full=True))
             t = 1
             while True:
                 if ticks_limit > 0 and t >= ticks_limit:
@@ -171,13 +331,8 @@ class EntityManager:
                         if data_in["status"] == "reset":
                             reset = True
                             break
-                    agents_data = {
-                        "status": [t, ticks_per_second],
-                        "agents_shapes": self.get_agent_shapes(),
-                        "agents_spins": self.get_agent_spins()
-                    }
                     if agents_queue.qsize() == 0:
-                        agents_queue.put(agents_data)
+                        agents_queue.put(self.pack_agents_data(t, ticks_per_second))
                 if reset: break
                 if arena_queue.qsize() > 0:
                     data_in = arena_queue.get()
@@ -201,6 +356,12 @@ class EntityManager:
                     for entity in entities:
                         if getattr(entity, "msg_enable", False) and entity.message_bus:
                             entity.send_message(t)
+                self.run_perception_batches(data_in["objects"])
+                self.run_spin_batches()
+                self.update_perception_grid(all_agent_instances)
+                self.run_vision_batches(data_in["objects"], all_agent_instances)
+                start_positions = self.state_store.arrays["position"].copy()
+                start_forward = self.state_store.arrays["forward_vector"].copy()
                 for _, entities in self.agents.values():
                     for entity in entities:
                         if getattr(entity, "msg_enable", False) and entity.message_bus:
@@ -211,26 +372,28 @@ class EntityManager:
                         # L'agente `entity` userà questa lista per percepire i suoi vicini.
                         entity.run(t, self.arena_shape, data_in["objects"], all_agent_instances)
 
-                        # --- METRICHE PER OGNI TICK ---
-                        P = self.compute_polarization(all_agent_instances)
-                        Rcm = self.compute_center_of_mass(all_agent_instances)
-                        polarization_over_time.append(P)
-                        center_of_mass_over_time.append(Rcm)
-                        # --- FINE METRICHE PER OGNI TICK ---
-
                         ### FINE MODIFICA ###
+                self.integrate_agents()
+
+                # --- METRICHE PER OGNI TICK (una riga per agente, nell'ordine in cui gli agenti si muovono) ---
+                P, Rcm = self.tick_metrics(start_positions, start_forward)
+                polarization_over_time.extend(P)
+                center_of_mass_over_time.extend(Rcm)
+                # --- FINE METRICHE PER OGNI TICK ---
     
-                agents_data = {
-                    "status": [t, ticks_per_second],
-                    "agents_shapes": self.get_agent_shapes(),
-                    "agents_spins": self.get_agent_spins()
-                }
-                detector_data = {
-                    "agents": self.pack_detector_data()
-                }
-                agents_queue.put(agents_data)
-                dec_agents_in.put(detector_data)
-                dec_data_in = dec_agents_out.get()
+                agents_queue.put(self.pack_agents_data(t, ticks_per_second))
+                if self.inline_collisions:
+                    dec_data_in = self.resolve_collisions(data_in["objects"])
+                else:
+                    # with shared_state the detector gets the full data once per run, then the write to read
+                    if self.shared_state is not None and t > 1:
+                        detector_data = {"state_write": self.state_write}
+                    else:
+                        detector_data = {
+                            "agents": self.pack_detector_data()
+                        }
+                    dec_agents_in.put(detector_data)
+                    dec_data_in = dec_agents_out.get()
                 for _, entities in self.agents.values():
                     pos = dec_data_in.get(entities[0].entity())
                     if pos is not None:
@@ -301,10 +464,10 @@ class EntityManager:
         for _, entities in self.agents.values():
             shapes = [entity.get_shape() for entity in entities]
             velocities = [entity.get_max_absolute_velocity() for entity in entities]
-            vectors = [entity.get_forward_vector() for entity in entities]
+            vectors = Vector3DArray(AgentStateStore.columns(entities, "forward_vector")).to_list()
             # [CORREZIONE] Usa la posizione CORRENTE, non quella precedente.
             # Questo assicura che la posizione del Vector3D e la posizione interna della shape siano sincronizzate.
-            positions = [entity.get_position() for entity in entities] # <-- CORRETTO
+            positions = Vector3DArray(AgentStateStore.columns(entities, "position")).to_list() # <-- CORRETTO
             names = [entity.get_name() for entity in entities]
             out[entities[0].entity()] = (shapes, velocities, vectors, positions, names)
         return out
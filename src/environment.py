@@ -6,6 +6,8 @@ from arena import ArenaFactory
 from gui import GuiFactory
 from entityManager import EntityManager
 from collision_detector import CollisionDetector
+from sharedstate import SharedAgentState
+from spinsystem import release_shared_couplings
 
 class EnvironmentFactory():
     @staticmethod
@@ -25,6 +27,13 @@ class Environment():
         self.gui_id = config_elem.gui.get("_id","2D")
         self.render = [True,config_elem.gui] if len(config_elem.gui)>0 else [False,{}]
         self.collisions = config_elem.environment.get("collisions",False)
+        self.collision_field_resolution = float(config_elem.environment.get("collision_field_resolution",0))
+        self.collision_mode = config_elem.environment.get("collision_mode","process")
+        if self.collision_mode not in ("process", "inline"):
+            raise ValueError(f"Invalid collision_mode: {self.collision_mode} valid modes are: process, inline")
+        self.state_transport = config_elem.environment.get("state_transport","queue")
+        if self.state_transport not in ("queue", "shared_memory"):
+            raise ValueError(f"Invalid state_transport: {self.state_transport} valid transports are: queue, shared_memory")
         if not self.render[0] and self.time_limit==0:
             raise Exception("Invalid configuration: infinite experiment with no GUI.")
 
@@ -51,12 +60,20 @@ class SingleProcessEnvironment(Environment):
         logging.info(f"Agents initialized: {list(agents.keys())}")
         return agents
 
-    def run_gui(self, config, arena_vertices, arena_color, gui_in_queue, gui_control_queue):
-        app, gui = GuiFactory.create_gui(config, arena_vertices, arena_color, gui_in_queue, gui_control_queue)
+    def run_gui(self, config, arena_vertices, arena_color, gui_in_queue, gui_control_queue, shared_state=None):
+        app, gui = GuiFactory.create_gui(config, arena_vertices, arena_color, gui_in_queue, gui_control_queue, shared_state)
         gui.show()
         app.exec()
 
     def start(self):
+        try:
+            self.run_experiments()
+        finally:
+            # also on failure: shared coupling tables live in /dev/shm until unlinked
+            release_shared_couplings()
+        logging.info("All experiments completed successfully")
+
+    def run_experiments(self):
         for exp in self.experiments:
             arena_queue = mp.Queue()
             agents_queue = mp.Queue()
@@ -70,118 +87,132 @@ class SingleProcessEnvironment(Environment):
             arena_shape = arena.get_shape()
             arena_id = arena.get_id()
             render_enabled = self.render[0]
-            collision_detector = CollisionDetector(arena_shape, self.collisions)
-            entity_manager = EntityManager(agents, arena_shape)
-            arena_process = mp.Process(target=arena.run, args=(self.num_runs, self.time_limit, arena_queue, agents_queue, gui_in_queue, dec_arena_in, gui_control_queue, render_enabled))
-            agents_process = mp.Process(target=entity_manager.run, args=(self.num_runs, self.time_limit, arena_queue, agents_queue, dec_agents_in, dec_agents_out, render_enabled))
-            detector_process = mp.Process(target=collision_detector.run, args=(dec_agents_in, dec_agents_out, dec_arena_in))
+            collision_detector = CollisionDetector(arena_shape, self.collisions, self.collision_field_resolution)
+            entity_manager = EntityManager(agents, arena_shape, exp.results.get("base_path", "../data/"))
+            solid_arena = arena_id not in ("abstract", "none", None)
+            inline_collisions = self.collision_mode == "inline"
+            if inline_collisions:
+                entity_manager.set_inline_collisions(collision_detector if solid_arena else None)
+            shared_state = None
+            try:
+                if self.state_transport == "shared_memory":
+                    shared_state = SharedAgentState.from_agents(agents)
+                    entity_manager.set_shared_state(shared_state)
+                    arena.set_shared_state(shared_state)
+                    collision_detector.set_shared_state(shared_state)
+                detector_objects_queue = dec_arena_in if solid_arena and not inline_collisions else None
+                arena_process = mp.Process(target=arena.run, args=(self.num_runs, self.time_limit, arena_queue, agents_queue, gui_in_queue, detector_objects_queue, gui_control_queue, render_enabled))
+                agents_process = mp.Process(target=entity_manager.run, args=(self.num_runs, self.time_limit, arena_queue, agents_queue, dec_agents_in, dec_agents_out, render_enabled))
+                detector_process = mp.Process(target=collision_detector.run, args=(dec_agents_in, dec_agents_out, dec_arena_in))
 
-            killed = 0
-            if render_enabled:
-                self.render[1]["_id"] = "abstract" if arena_id in (None, "none") else self.gui_id
-                gui_process = mp.Process(target=self.run_gui, args=(self.render[1], arena_shape.vertices(), arena_shape.color(), gui_in_queue, gui_control_queue))
-                gui_process.start()
-                if arena_id not in ("abstract", "none", None):
-                    detector_process.start()
-                agents_process.start()
-                arena_process.start()
-                while True:
-                    arena_alive = arena_process.is_alive()
-                    agents_alive = agents_process.is_alive()
-                    gui_alive = gui_process.is_alive()
-                    detector_alive = detector_process.is_alive() if detector_process.pid is not None else False
-                    arena_exit = arena_process.exitcode
-                    agents_exit = agents_process.exitcode
-                    gui_exit = gui_process.exitcode
-                    # Check for process failures
-                    if arena_exit not in (None, 0):
-                        killed = 1
-                        if agents_alive: agents_process.terminate()
-                        if gui_alive: gui_process.terminate()
-                        if detector_alive: detector_process.terminate()
-                        if arena_process.pid is not None: arena_process.join()
-                        if agents_process.pid is not None: agents_process.join()
-                        if detector_process.pid is not None: detector_process.join()
-                        if gui_process.pid is not None: gui_process.join()
-                        arena.close()
-                        entity_manager.close()
-                        raise RuntimeError("A subprocess exited unexpectedly.")
-                    elif agents_exit not in (None, 0):
-                        killed = 1
-                        if arena_alive: arena_process.terminate()
-                        if gui_alive: gui_process.terminate()
-                        if detector_alive: detector_process.terminate()
-                        if arena_process.pid is not None: arena_process.join()
-                        if agents_process.pid is not None: agents_process.join()
-                        if detector_process.pid is not None: detector_process.join()
-                        if gui_process.pid is not None: gui_process.join()
-                        arena.close()
-                        entity_manager.close()
-                        raise RuntimeError("A subprocess exited unexpectedly.")
-                    elif render_enabled and gui_exit not in (None, 0):
-                        killed = 1
-                        if arena_alive: arena_process.terminate()
-                        if agents_alive: agents_process.terminate()
-                        if detector_alive: detector_process.terminate()
-                        if arena_process.pid is not None: arena_process.join()
-                        if agents_process.pid is not None: agents_process.join()
-                        if detector_process.pid is not None: detector_process.join()
-                        if gui_process.pid is not None: gui_process.join()
-                        arena.close()
-                        entity_manager.close()
-                        raise RuntimeError("A subprocess exited unexpectedly.")
-                    # Zombie/Dead GUI process
-                    if killed == 0 and gui_process.pid is not None:
-                        gui_status = psutil.Process(gui_process.pid).status()
-                        if gui_status in (psutil.STATUS_ZOMBIE, psutil.STATUS_DEAD):
+                killed = 0
+                if render_enabled:
+                    self.render[1]["_id"] = "abstract" if arena_id in (None, "none") else self.gui_id
+                    gui_process = mp.Process(target=self.run_gui, args=(self.render[1], arena_shape.vertices(), arena_shape.color(), gui_in_queue, gui_control_queue, shared_state))
+                    gui_process.start()
+                    if solid_arena and not inline_collisions:
+                        detector_process.start()
+                    agents_process.start()
+                    arena_process.start()
+                    while True:
+                        arena_alive = arena_process.is_alive()
+                        agents_alive = agents_process.is_alive()
+                        gui_alive = gui_process.is_alive()
+                        detector_alive = detector_process.is_alive() if detector_process.pid is not None else False
+                        arena_exit = arena_process.exitcode
+                        agents_exit = agents_process.exitcode
+                        gui_exit = gui_process.exitcode
+                        # Check for process failures
+                        if arena_exit not in (None, 0):
+                            killed = 1
+                            if agents_alive: agents_process.terminate()
+                            if gui_alive: gui_process.terminate()
+                            if detector_alive: detector_process.terminate()
+                            if arena_process.pid is not None: arena_process.join()
+                            if agents_process.pid is not None: agents_process.join()
+                            if detector_process.pid is not None: detector_process.join()
+                            if gui_process.pid is not None: gui_process.join()
+                            arena.close()
+                            entity_manager.close()
+                            raise RuntimeError("A subprocess exited unexpectedly.")
+                        elif agents_exit not in (None, 0):
                             killed = 1
                             if arena_alive: arena_process.terminate()
+                            if gui_alive: gui_process.terminate()
+                            if detector_alive: detector_process.terminate()
+                            if arena_process.pid is not None: arena_process.join()
+                            if agents_process.pid is not None: agents_process.join()
+                            if detector_process.pid is not None: detector_process.join()
+                            if gui_process.pid is not None: gui_process.join()
+                            arena.close()
+                            entity_manager.close()
+                            raise RuntimeError("A subprocess exited unexpectedly.")
+                        elif render_enabled and gui_exit not in (None, 0):
+                            killed = 1
+                            if arena_alive: arena_process.terminate()
+                            if agents_alive: agents_process.terminate()
+                            if detector_alive: detector_process.terminate()
+                            if arena_process.pid is not None: arena_process.join()
+                            if agents_process.pid is not None: agents_process.join()
+                            if detector_process.pid is not None: detector_process.join()
+                            if gui_process.pid is not None: gui_process.join()
+                            arena.close()
+                            entity_manager.close()
+                            raise RuntimeError("A subprocess exited unexpectedly.")
+                        # Zombie/Dead GUI process
+                        if killed == 0 and gui_process.pid is not None:
+                            gui_status = psutil.Process(gui_process.pid).status()
+                            if gui_status in (psutil.STATUS_ZOMBIE, psutil.STATUS_DEAD):
+                                killed = 1
+                                if arena_alive: arena_process.terminate()
+                                if agents_alive: agents_process.terminate()
+                                if detector_alive: detector_process.terminate()
+                                arena.close()
+                                entity_manager.close()
+                                break
+                        if not arena_alive:
                             if agents_alive: agents_process.terminate()
                             if detector_alive: detector_process.terminate()
+                            if gui_alive: gui_process.terminate()
                             arena.close()
                             entity_manager.close()
                             break
-                    if not arena_alive:
-                        if agents_alive: agents_process.terminate()
-                        if detector_alive: detector_process.terminate()
-                        if gui_alive: gui_process.terminate()
-                        arena.close()
-                        entity_manager.close()
-                        break
-                # Join all processes
-                if arena_process.pid is not None: arena_process.join()
-                if agents_process.pid is not None: agents_process.join()
-                if detector_process.pid is not None: detector_process.join()
-                if gui_process.pid is not None: gui_process.join()
-            else:
-                if arena_id not in ("abstract", "none", None):
-                    detector_process.start()
-                agents_process.start()
-                arena_process.start()
-                while arena_process.is_alive() and agents_process.is_alive():
-                    arena_process.join(timeout=0.1)
-                    agents_process.join(timeout=0.1)
-                killed = 0
-                if arena_process.exitcode not in (None, 0):
-                    killed = 1
-                    if agents_process.is_alive(): agents_process.terminate()
-                    if detector_process.is_alive(): detector_process.terminate()
-                elif agents_process.exitcode not in (None, 0):
-                    killed = 1
-                    if arena_process.is_alive(): arena_process.terminate()
-                    if detector_process.is_alive(): detector_process.terminate()
-                # Join all processes
-                if arena_process.pid is not None: arena_process.join()
-                if agents_process.pid is not None: agents_process.join()
-                if detector_process.pid is not None:
-                    detector_process.terminate()
-                    detector_process.join()
-                arena.close()
-                entity_manager.close()
-                if killed == 1:
-                    raise RuntimeError("A subprocess exited unexpectedly.")
+                    # Join all processes
+                    if arena_process.pid is not None: arena_process.join()
+                    if agents_process.pid is not None: agents_process.join()
+                    if detector_process.pid is not None: detector_process.join()
+                    if gui_process.pid is not None: gui_process.join()
+                else:
+                    if solid_arena and not inline_collisions:
+                        detector_process.start()
+                    agents_process.start()
+                    arena_process.start()
+                    while arena_process.is_alive() and agents_process.is_alive():
+                        arena_process.join(timeout=0.1)
+                        agents_process.join(timeout=0.1)
+                    killed = 0
+                    if arena_process.exitcode not in (None, 0):
+                        killed = 1
+                        if agents_process.is_alive(): agents_process.terminate()
+                        if detector_process.is_alive(): detector_process.terminate()
+                    elif agents_process.exitcode not in (None, 0):
+                        killed = 1
+                        if arena_process.is_alive(): arena_process.terminate()
+                        if detector_process.is_alive(): detector_process.terminate()
+                    # Join all processes
+                    if arena_process.pid is not None: arena_process.join()
+                    if agents_process.pid is not None: agents_process.join()
+                    if detector_process.pid is not None:
+                        detector_process.terminate()
+                        detector_process.join()
+                    arena.close()
+                    entity_manager.close()
+                    if killed == 1:
+                        raise RuntimeError("A subprocess exited unexpectedly.")
+            finally:
+                # also on failures and early exits: the block lives in /dev/shm until unlinked
+                if shared_state is not None: shared_state.release()
             gc.collect()
-        logging.info("All experiments completed successfully")
 
 class MultiProcessEnvironment(Environment):
     def __init__(self,config_elem:Config):
@@ -1,6 +1,9 @@
 import math
+import numpy as np
 
 class Vector3D:
+    __slots__ = ("x", "y", "z")
+
     def __init__(self, x:float=0, y:float=0, z:float=0):
         self.x = x
         self.y = y
@@ -18,6 +21,31 @@ class Vector3D:
     def __truediv__(self, scalar):
         return Vector3D(self.x / scalar, self.y / scalar, self.z / scalar)
 
+    # In-place variants: they modify and return self, so only use them on vectors nobody else references.
+    def iadd(self, other):
+        self.x += other.x
+        self.y += other.y
+        self.z += other.z
+        return self
+
+    def isub(self, other):
+        self.x -= other.x
+        self.y -= other.y
+        self.z -= other.z
+        return self
+
+    def imul(self, scalar):
+        self.x *= scalar
+        self.y *= scalar
+        self.z *= scalar
+        return self
+
+    def set(self, x:float=0, y:float=0, z:float=0):
+        self.x = x
+        self.y = y
+        self.z = z
+        return self
+
     def dot(self, other):
         return self.x * other.x + self.y * other.y + self.z * other.z
 
@@ -44,5 +72,86 @@ class Vector3D:
         rotated = Vector3D(x, y, 0)
         return rotated + point
 
+    def __reduce__(self):
+        return (Vector3D, (self.x, self.y, self.z))
+
+    def __setstate__(self, state):
+        # pickles of the former __dict__-based class carry the attributes as a dict
+        if isinstance(state, tuple):
+            state = state[-1] if state[-1] is not None else {}
+        for name, value in state.items():
+            setattr(self, name, value)
+
     def __repr__(self) -> str:
         return f"Vector3D({self.x}, {self.y}, {self.z})"
+
+
+class Vector3DArray:
+    """Batch of 3D vectors in one (n, 3) float64 array.
+
+    Indexing and iteration return Vector3D copies, so it can replace a list of Vector3D
+    wherever the vectors are only read. A float64 array passed as data is wrapped, not copied.
+    """
+    __slots__ = ("data",)
+
+    def __init__(self, data=None):
+        self.data = np.zeros((0, 3)) if data is None else np.asarray(data, dtype=float).reshape(-1, 3)
+
+    @staticmethod
+    def from_vectors(vectors):
+        return Vector3DArray([[v.x, v.y, v.z] for v in vectors])
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return Vector3DArray(self.data[index].copy())
+        x, y, z = self.data[index].tolist()
+        return Vector3D(x, y, z)
+
+    def __setitem__(self, index, vector):
+        self.data[index] = (vector.x, vector.y, vector.z)
+
+    def __iter__(self):
+        for x, y, z in self.data.tolist():
+            yield Vector3D(x, y, z)
+
+    def to_list(self):
+        return list(self)
+
+    def copy(self):
+        return Vector3DArray(self.data.copy())
+
+    def translate(self, offset):
+        """Add offset to every vector in place."""
+        self.data += (offset.x, offset.y, offset.z)
+        return self
+
+    def rotate_z(self, center, angle_rad:float):
+        """Rotate every vector in place by angle_rad around the z axis through center."""
+        cos_z = math.cos(angle_rad)
+        sin_z = math.sin(angle_rad)
+        x_shift = self.data[:, 0] - center.x
+        y_shift = self.data[:, 1] - center.y
+        self.data[:, 0] = center.x + x_shift * cos_z - y_shift * sin_z
+        self.data[:, 1] = center.y + x_shift * sin_z + y_shift * cos_z
+        return self
+
+    def min(self):
+        if not len(self.data):
+            return Vector3D()
+        x, y, z = self.data.min(axis=0).tolist()
+        return Vector3D(x, y, z)
+
+    def max(self):
+        if not len(self.data):
+            return Vector3D()
+        x, y, z = self.data.max(axis=0).tolist()
+        return Vector3D(x, y, z)
+
+    def __reduce__(self):
+        return (Vector3DArray, (self.data,))
+
+    def __repr__(self) -> str:
+        return f"Vector3DArray({len(self.data)} vectors)"
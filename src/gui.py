@@ -9,14 +9,14 @@ from PySide6.QtGui import QPolygonF, QColor, QPen, QBrush, QMouseEvent
 class GuiFactory():
 
     @staticmethod
-    def create_gui(config_elem:dict,arena_vertices,arena_color,gui_in_queue,gui_control_queue):
+    def create_gui(config_elem:dict,arena_vertices,arena_color,gui_in_queue,gui_control_queue,shared_state=None):
         if config_elem.get("_id") in ("2D","abstract"):
-            return QApplication([]),GUI_2D(config_elem,arena_vertices,arena_color,gui_in_queue,gui_control_queue)
+            return QApplication([]),GUI_2D(config_elem,arena_vertices,arena_color,gui_in_queue,gui_control_queue,shared_state)
         else:
             raise ValueError(f"Invalid gui type: {config_elem.get('_id')} valid types are '2D' or 'abstract'")
 
 class GUI_2D(QWidget):
-    def __init__(self, config_elem: dict,arena_vertices,arena_color,gui_in_queue,gui_control_queue):
+    def __init__(self, config_elem: dict,arena_vertices,arena_color,gui_in_queue,gui_control_queue,shared_state=None):
         super().__init__()
         self._id = "2D"
         self.on_click = config_elem.get("on_click", None)
@@ -24,6 +24,8 @@ class GUI_2D(QWidget):
         self.arena_color = arena_color
         self.gui_in_queue = gui_in_queue
         self.gui_control_queue = gui_control_queue
+        # when set, the agents only come with the first message of a run and then move through it
+        self.shared_state = shared_state
         self.setWindowTitle("Arena GUI")
 
         self._main_layout = QHBoxLayout()
@@ -213,8 +215,14 @@ class GUI_2D(QWidget):
                 for k, item in data["objects"].items():
                     o_shapes.update({k:item[0]})
                 self.objects_shapes = o_shapes
-                self.agents_shapes = data["agents_shapes"]
-                self.agents_spins = data["agents_spins"]
+                if "agents_shapes" in data:
+                    self.agents_shapes = data["agents_shapes"]
+                    self.agents_spins = data["agents_spins"]
+                elif self.shared_state is not None and self.agents_shapes and data.get("state_write") is not None:
+                    spins = self.shared_state.update_shapes(self.agents_shapes, self.agents_spins, data["state_write"])
+                    # a gui lagging behind the agents keeps its last frame rather than draw a later tick
+                    if spins is not None:
+                        self.agents_spins = spins
             self.update_scene()
             if self.canvas_visible: self.update_spins_plot()
             self.update()
@@ -0,0 +1,137 @@
+import math
+import numpy as np
+from collections import OrderedDict
+from agentstate import AgentStateStore
+
+_PI = math.pi
+_MAX_TABLE_STEPS = 1 << 16
+# least recently used widths are dropped past either bound
+_MAX_TABLES = 64
+_MAX_TABLE_BYTES = 64 << 20
+_KERNELS = {}
+
+class PerceptionKernels:
+    """Gaussian perception kernels over the group angles of a ring, tabulated by bearing.
+
+    An object seen at bearing theta with effective width sigma = sigma0 + uncertainty weighs
+    (sigma0 / sigma) * exp(-d^2 / (2 sigma^2)) on the group at angular distance d. For each
+    width the kernels of M evenly spaced bearings are precomputed, M chosen so that rounding
+    a bearing to the nearest one changes no weight by more than tolerance (per unit strength).
+    With tolerance 0 (the default), or widths that would need more than _MAX_TABLE_STEPS
+    bearings, the kernels are evaluated exactly. The tables of the most recently used
+    widths are kept, within _MAX_TABLES tables and _MAX_TABLE_BYTES bytes.
+    """
+    def __init__(self, num_groups, sigma0, tolerance=0.0):
+        self.num_groups = num_groups
+        self.sigma0 = float(sigma0)
+        self.tolerance = float(tolerance)
+        self.group_angles = np.linspace(0, 2 * _PI, num_groups, endpoint=False)
+        self.tables = OrderedDict()
+        self.table_bytes = 0
+
+    @staticmethod
+    def shared(num_groups, sigma0, tolerance=0.0):
+        """Process-wide cached instance for the given ring and width."""
+        key = (num_groups, float(sigma0), float(tolerance))
+        kernels = _KERNELS.get(key)
+        if kernels is None:
+            kernels = PerceptionKernels(num_groups, sigma0, tolerance)
+            _KERNELS[key] = kernels
+        return kernels
+
+    def _exact(self, bearings, effective_width):
+        angle_diffs = np.abs(self.group_angles - np.asarray(bearings)[..., None])
+        angle_diffs = np.minimum(angle_diffs, 2 * _PI - angle_diffs)
+        sigma = max(effective_width, 1e-6)
+        return (self.sigma0 / sigma) * np.exp(-(angle_diffs ** 2) / (2 * (sigma ** 2)))
+
+    def _table(self, effective_width):
+        table = self.tables.get(effective_width)
+        if table is not None:
+            self.tables.move_to_end(effective_width)
+            return table
+        table = False
+        if self.tolerance > 0:
+            sigma = max(effective_width, 1e-6)
+            # largest slope of the kernel, reached at d = sigma
+            slope = abs(self.sigma0) / sigma ** 2 * math.exp(-0.5)
+            steps = max(self.num_groups, math.ceil(_PI * slope / self.tolerance))
+            if steps <= _MAX_TABLE_STEPS:
+                table = self._exact(np.arange(steps) * (2 * _PI / steps), effective_width)
+        self.tables[effective_width] = table
+        self.table_bytes += 0 if table is False else table.nbytes
+        while len(self.tables) > 1 and (len(self.tables) > _MAX_TABLES or self.table_bytes > _MAX_TABLE_BYTES):
+            _, dropped = self.tables.popitem(last=False)
+            self.table_bytes -= 0 if dropped is False else dropped.nbytes
+        return table
+
+    def kernels(self, bearings, effective_width):
+        """(..., groups) kernels of the bearings (radians) for one effective width."""
+        table = self._table(effective_width)
+        if table is False:
+            return self._exact(bearings, effective_width)
+        steps = len(table)
+        index = np.rint(bearings * (steps / (2 * _PI))).astype(np.intp)
+        index %= steps
+        return table[index]
+
+    def weights(self, bearings, effective_widths, strengths):
+        """Group weights summed over the objects: bearings (..., objects), widths and strengths (objects,)."""
+        bearings = np.asarray(bearings, dtype=float)
+        strengths = np.asarray(strengths, dtype=float)
+        distinct_widths = set(float(w) for w in effective_widths)
+        if len(distinct_widths) == 1:
+            return strengths @ self.kernels(bearings, distinct_widths.pop())
+        weights = np.zeros(bearings.shape[:-1] + (self.num_groups,))
+        effective_widths = np.asarray(effective_widths, dtype=float)
+        for effective_width in distinct_widths:
+            objects = effective_widths == effective_width
+            weights += strengths[objects] @ self.kernels(bearings[..., objects], effective_width)
+        return weights
+
+
+class BatchedPerception:
+    """Perception vectors of all the spin-model agents of one type, from one (agents x objects) bearing matrix."""
+    def __init__(self, entities):
+        first = entities[0]
+        self.entities = entities
+        self.kernels = first.perception_kernels
+        self.sigma0 = first.perception_width
+        self.num_spins_per_group = first.num_spins_per_group
+        self.global_inhibition = first.perception_global_inhibition
+        self.egocentric = first.reference == "egocentric"
+
+    @staticmethod
+    def object_arrays(objects):
+        """Positions, strengths and uncertainties of all the objects as flat arrays."""
+        xs, ys, object_strengths, object_uncertainties = [], [], [], []
+        for _, (shapes, positions, strengths, uncertainties) in objects.items():
+            for n in range(len(shapes)):
+                xs.append(positions[n].x)
+                ys.append(positions[n].y)
+                object_strengths.append(strengths[n])
+                object_uncertainties.append(uncertainties[n])
+        return (np.array(xs, dtype=float), np.array(ys, dtype=float),
+                np.array(object_strengths, dtype=float), np.array(object_uncertainties, dtype=float))
+
+    def perceptions(self, object_arrays):
+        """(agents, groups * spins) perception vectors, as computed by MovableAgent.update_detection."""
+        xs, ys, strengths, uncertainties = object_arrays
+        agent_positions = AgentStateStore.columns(self.entities, "position")
+        agent_xs, agent_ys = agent_positions[:, 0], agent_positions[:, 1]
+        angles = np.degrees(np.arctan2(-(ys[None, :] - agent_ys[:, None]), xs[None, :] - agent_xs[:, None]))
+        if self.egocentric:
+            angles -= AgentStateStore.columns(self.entities, "orientation")[:, 2][:, None]
+        bearings = np.radians(((angles + 180) % 360) - 180)
+        weights = self.kernels.weights(bearings, self.sigma0 + uncertainties, strengths)
+        return np.repeat(weights, self.num_spins_per_group, axis=1) - self.global_inhibition
+
+    def update(self, object_arrays, spin_batch=None):
+        """Store the perception of every agent and write it into the external fields of the spin systems."""
+        perceptions = self.perceptions(object_arrays)
+        if spin_batch is not None:
+            spin_batch.external_field[:] = perceptions
+        for n, entity in enumerate(self.entities):
+            entity.perception = perceptions[n]
+            if spin_batch is None:
+                entity.spin_system.update_external_field(perceptions[n])
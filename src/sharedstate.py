@@ -0,0 +1,161 @@
+import math
+import time
+import numpy as np
+from multiprocessing import shared_memory
+from agentstate import AgentStateStore
+from geometry_utils.vector3D import Vector3D
+
+class SharedAgentState:
+    """State of all the agents in one multiprocessing shared memory block, written by the agents process.
+
+    Every agent type owns a fixed range of rows of the "state" array, one per entity in order,
+    holding the COLUMNS of its kinematic state; spin-model types also get arrays with their spin
+    states, external fields and activity directions. The last SLOTS writes are kept: write w goes
+    to slot w % SLOTS, whose header holds a sequence counter, odd while the slot is being written,
+    and w. A message then only needs to carry w for its reader to find the state it was sent with;
+    a reader more than SLOTS - 1 writes behind finds the slot overwritten and is told so.
+
+    The readers get the full shapes and spins once per run and re-place them on the written state.
+    Pickled copies attach to the block by name.
+    """
+    COLUMNS = ("x", "y", "z", "heading", "forward_x", "forward_y", "forward_z")
+    SLOTS = 4
+
+    def __init__(self, layout, name=None):
+        """layout: (agent type key, number of agents, spin groups, spins per group) per agent type."""
+        self.layout = [tuple(entry) for entry in layout]
+        self.rows = {}
+        specs = [("header", (2,), np.int64)]
+        num_rows = 0
+        for key, count, num_groups, num_spins_per_group in self.layout:
+            self.rows[key] = slice(num_rows, num_rows + count)
+            num_rows += count
+            if num_groups * num_spins_per_group > 0:
+                specs.append(("spins_" + key, (count, num_groups, num_spins_per_group), np.uint8))
+                specs.append(("field_" + key, (count, num_groups * num_spins_per_group), np.float32))
+                specs.append(("direction_" + key, (count,), np.float64))
+        specs.append(("state", (num_rows, len(SharedAgentState.COLUMNS)), np.float64))
+        offsets, size = [], 0
+        for _, shape, dtype in specs:
+            offsets.append(size)
+            size += (SharedAgentState.SLOTS * int(np.prod(shape)) * np.dtype(dtype).itemsize + 7) // 8 * 8
+        self.owner = name is None
+        self.block = shared_memory.SharedMemory(name=name, create=self.owner, size=max(size, 8))
+        self.arrays = {spec_name: np.ndarray((SharedAgentState.SLOTS,) + shape, dtype=dtype, buffer=self.block.buf, offset=offset)
+                       for (spec_name, shape, dtype), offset in zip(specs, offsets)}
+        if self.owner:
+            for array in self.arrays.values():
+                array.fill(0)
+            self.arrays["header"][:, 1] = -1
+        self.writes = 0
+
+    @staticmethod
+    def from_agents(agents):
+        """Block sized for the agents dict of an EntityManager."""
+        layout = []
+        for _, entities in agents.values():
+            if not entities:
+                continue
+            first = entities[0]
+            if getattr(first, "moving_behavior", None) == "spin_model":
+                layout.append((first.entity(), len(entities), first.num_groups, first.num_spins_per_group))
+            else:
+                layout.append((first.entity(), len(entities), 0, 0))
+        return SharedAgentState(layout)
+
+    def __getstate__(self):
+        return {"layout": self.layout, "name": self.block.name}
+
+    def __setstate__(self, state):
+        self.__init__(state["layout"], state["name"])
+
+    def release(self):
+        """Unlink the shared memory block if this instance created it."""
+        if self.owner:
+            self.block.unlink()
+            self.owner = False
+
+    def write(self, agents) -> int:
+        """Store the current state of agents, the agents dict of an EntityManager; returns the write number."""
+        write = self.writes
+        self.writes += 1
+        slot = write % SharedAgentState.SLOTS
+        header = self.arrays["header"][slot]
+        state = self.arrays["state"][slot]
+        header[0] += 1
+        for _, entities in agents.values():
+            if not entities:
+                continue
+            key = entities[0].entity()
+            rows = self.rows[key]
+            state[rows, 0:3] = AgentStateStore.columns(entities, "position")
+            state[rows, 3] = AgentStateStore.columns(entities, "orientation")[:, 2]
+            state[rows, 4:7] = AgentStateStore.columns(entities, "forward_vector")
+            spins = self.arrays.get("spins_" + key)
+            if spins is not None:
+                spins, fields, directions = spins[slot], self.arrays["field_" + key][slot], self.arrays["direction_" + key][slot]
+                for n, entity in enumerate(entities):
+                    states, _, field, direction = entity.get_spin_system_data()
+                    spins[n] = states
+                    fields[n] = field
+                    directions[n] = math.nan if direction is None else direction
+        header[1] = write
+        header[0] += 1
+        return write
+
+    def snapshot(self, write:int):
+        """Consistent copy of the arrays of write, None if a later write has replaced it in its slot."""
+        header = self.arrays["header"][write % SharedAgentState.SLOTS]
+        while True:
+            sequence = int(header[0])
+            if sequence % 2 == 0:
+                written = int(header[1])
+                arrays = {name: array[write % SharedAgentState.SLOTS].copy() for name, array in self.arrays.items() if name != "header"}
+                if int(header[0]) == sequence:
+                    return arrays if written == write else None
+            # the writer holds the slot: give it the core instead of spinning
+            time.sleep(0)
+
+    def update_shapes(self, shapes, spins, write:int):
+        """Move the agents shapes, as sent by the agents process, to the state of write.
+
+        Returns the spins of write, taking the static ring angles from spins, or None leaving the
+        shapes untouched if write was overwritten.
+        """
+        arrays = self.snapshot(write)
+        if arrays is None:
+            return None
+        state = arrays["state"]
+        updated_spins = {}
+        for key, key_shapes in shapes.items():
+            rows = self.rows.get(key)
+            if rows is None:
+                continue
+            for shape, (x, y, z, heading) in zip(key_shapes, state[rows, :4].tolist()):
+                shape.translate(Vector3D(x, y, z))
+                shape.translate_attachments(heading)
+            key_spins = spins.get(key) if spins is not None else None
+            if key_spins is None:
+                continue
+            if "spins_" + key not in arrays:
+                updated_spins[key] = key_spins
+                continue
+            spin_states, fields, directions = arrays["spins_" + key], arrays["field_" + key], arrays["direction_" + key]
+            updated_spins[key] = [
+                None if spin is None else (spin_states[n], spin[1], fields[n], None if math.isnan(directions[n]) else float(directions[n]))
+                for n, spin in enumerate(key_spins)
+            ]
+        return updated_spins
+
+    def update_detector_data(self, agents, write:int):
+        """Move shapes, forward vectors and positions of EntityManager.pack_detector_data() output to the state of write."""
+        arrays = self.snapshot(write)
+        if arrays is None:
+            raise RuntimeError(f"Shared state write {write} was overwritten before the collision detector read it.")
+        state = arrays["state"]
+        for key, (shapes, _, vectors, positions, _) in agents.items():
+            for n, (x, y, z, heading, forward_x, forward_y, forward_z) in enumerate(state[self.rows[key]].tolist()):
+                shapes[n].translate(Vector3D(x, y, z))
+                shapes[n].translate_attachments(heading)
+                vectors[n] = Vector3D(forward_x, forward_y, forward_z)
+                positions[n] = Vector3D(x, y, z)
@@ -1,3 +1,4 @@
+import math
 from collections import defaultdict
 
 class SpatialGrid:
@@ -15,6 +16,10 @@ class SpatialGrid:
         cell = self._cell_coords(agent.get_position())
         self.grid[cell].append(agent)
 
+    def add(self, item, pos):
+        """Insert any item at pos."""
+        self.grid[self._cell_coords(pos)].append(item)
+
     def neighbors(self, agent, radius):
         pos = agent.get_position()
         cell_x, cell_y = self._cell_coords(pos)
@@ -28,6 +33,22 @@ class SpatialGrid:
                             neighbors.append(other)
         return neighbors
     
+    def candidates(self, pos, radius):
+        """Agents in the cells that can hold points within radius of pos, not filtered by distance."""
+        cell_x, cell_y = self._cell_coords(pos)
+        reach = max(1, math.ceil(radius / self.cell_size))
+        candidates = []
+        if (2 * reach + 1) ** 2 > len(self.grid):
+            # fewer occupied cells than cells in reach: visit those, in the same order
+            for cell in sorted(self.grid):
+                if abs(cell[0] - cell_x) <= reach and abs(cell[1] - cell_y) <= reach:
+                    candidates.extend(self.grid[cell])
+            return candidates
+        for dx in range(-reach, reach + 1):
+            for dy in range(-reach, reach + 1):
+                candidates.extend(self.grid.get((cell_x + dx, cell_y + dy), []))
+        return candidates
+
     def close(self):
         del self.grid, self.cell_size
         return
\ No newline at end of file
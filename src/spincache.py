@@ -0,0 +1,75 @@
+import os, json, pickle, hashlib
+from collections import OrderedDict
+
+class PreRunCache:
+    """LRU cache of spin pre-run results.
+
+    Entries are kept in memory (up to capacity) and, when a path is given, also pickled
+    on disk (up to disk_capacity files, the least recently used ones are removed first).
+    Keys cover VERSION, to be raised whenever the pre-run or the stored results change meaning.
+    """
+    VERSION = 1
+
+    def __init__(self, capacity:int=0, path:str=None, disk_capacity:int=0):
+        self.capacity = capacity
+        self.disk_capacity = disk_capacity
+        self.path = path if disk_capacity > 0 else None
+        self.entries = OrderedDict()
+        if self.path is not None:
+            os.makedirs(self.path, exist_ok=True)
+
+    @staticmethod
+    def key(parameters:dict, perception, random_state) -> str:
+        """Key of a pre-run with the resolved spin system parameters, from perception and random_state."""
+        digest = hashlib.sha256()
+        digest.update(json.dumps({"version": PreRunCache.VERSION, **parameters}, sort_keys=True, default=str).encode())
+        digest.update(perception.tobytes() if perception is not None else b"")
+        digest.update(pickle.dumps(random_state, protocol=pickle.HIGHEST_PROTOCOL))
+        return digest.hexdigest()
+
+    def _file(self, key:str) -> str:
+        return os.path.join(self.path, f"{key}.pkl")
+
+    def get(self, key:str):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        if self.path is None:
+            return None
+        file_path = self._file(key)
+        try:
+            with open(file_path, "rb") as f:
+                value = pickle.load(f)
+            os.utime(file_path)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        self._store(key, value)
+        return value
+
+    def put(self, key:str, value):
+        self._store(key, value)
+        if self.path is None:
+            return
+        tmp_path = self._file(key) + f".{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self._file(key))
+        files = [os.path.join(self.path, name) for name in os.listdir(self.path) if name.endswith(".pkl")]
+        if len(files) > self.disk_capacity:
+            files.sort(key=lambda name: os.path.getmtime(name))
+            for name in files[:len(files) - self.disk_capacity]:
+                try:
+                    os.remove(name)
+                except OSError:
+                    pass
+
+    def _store(self, key:str, value):
+        if self.capacity <= 0:
+            return
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def close(self):
+        self.entries.clear()
@@ -1,12 +1,177 @@
 import math
 import numpy as np
 from random import Random
+from multiprocessing import shared_memory
 
 _PI = math.pi
+_NO_FLIP = -1
+_STATE_CHANGED = -2
+_LOW_RANK_MAX = 4
+_RING_COUPLINGS = {}
+_DRAW_BLOCK = 1024
+# own and reference spin of the four kmc site classes, class = 2 * own + reference
+_KMC_OWN = np.array([0.0, 0.0, 1.0, 1.0])
+_KMC_REFERENCE = np.array([0.0, 1.0, 0.0, 1.0])
+
+class RingCoupling:
+    """Coupling matrix J of a ring of num_groups groups with num_spins_per_group spins each.
+
+    J only depends on the angular distance between groups, so it is block circulant and the
+    (groups x groups) matrix of group couplings describes it entirely. In "circulant" and
+    "low_rank" mode fields are kept per group and evaluated by FFT or through the nonzero
+    eigenpairs of the group matrix; "dense" keeps the full N x N matrix and per spin fields.
+
+    All the tables are read-only. With use_shared_memory they live in multiprocessing
+    shared memory blocks: forked workers inherit the mapping and pickled copies attach to
+    the same blocks by name instead of carrying the data.
+    """
+    MODES = ("auto", "dense", "circulant", "low_rank")
+    TABLES = ("angles", "unit_vectors", "group_matrix", "row_matrix", "field_index", "eigenvalues", "eigenvectors", "kernel_spectrum", "_dense_matrix")
+
+    def __init__(self, num_groups, num_spins_per_group, nu, mode="auto", tol=1e-9, use_shared_memory=False):
+        if mode not in RingCoupling.MODES:
+            raise ValueError(f"Unknown coupling mode: {mode}")
+        self.num_groups = num_groups
+        self.num_spins_per_group = num_spins_per_group
+        self.use_shared_memory = use_shared_memory
+        self.shared_blocks = {}
+        self.owned_blocks = []
+        group_angles = np.linspace(0, 2 * _PI, num_groups, endpoint=False)
+        self.angles = self._table("angles", np.repeat(group_angles, num_spins_per_group))
+        self.unit_vectors = self._table("unit_vectors", np.exp(1j * self.angles))
+        angle_diff_matrix = np.abs(np.subtract.outer(group_angles, group_angles))
+        angle_diff_matrix = np.minimum(angle_diff_matrix, 2 * _PI - angle_diff_matrix)
+        self.group_matrix = self._table("group_matrix", np.cos(_PI * ((angle_diff_matrix / _PI) ** nu)))
+        self.self_coupling = float(self.group_matrix[0, 0])
+        eigenvalues, eigenvectors = np.linalg.eigh(self.group_matrix)
+        nonzero = np.abs(eigenvalues) > tol * max(np.abs(eigenvalues).max(), 1.0)
+        if mode == "auto":
+            mode = "low_rank" if np.count_nonzero(nonzero) <= _LOW_RANK_MAX else "circulant"
+        self.mode = mode
+        self._dense_matrix = None
+        self.eigenvalues = self.eigenvectors = self.kernel_spectrum = None
+        if mode == "dense":
+            # tabulated here rather than on first use, so the block belongs to the creating process
+            self._dense_matrix = self._table("_dense_matrix", self._expand(self.group_matrix))
+            self.row_matrix = self._alias("row_matrix", "_dense_matrix")
+            self.field_index = self._table("field_index", np.arange(num_groups * num_spins_per_group))
+        else:
+            self.row_matrix = self._alias("row_matrix", "group_matrix")
+            self.field_index = self._table("field_index", np.repeat(np.arange(num_groups), num_spins_per_group))
+            if mode == "low_rank":
+                self.eigenvalues = self._table("eigenvalues", eigenvalues[nonzero])
+                self.eigenvectors = self._table("eigenvectors", eigenvectors[:, nonzero])
+            else:
+                self.kernel_spectrum = self._table("kernel_spectrum", np.fft.rfft(self.group_matrix[0]).real)
+
+    @staticmethod
+    def shared(num_groups, num_spins_per_group, nu, mode="auto", use_shared_memory=False):
+        """Process-wide cached instance for the given ring parameters."""
+        key = (num_groups, num_spins_per_group, float(nu), mode, use_shared_memory)
+        ring_coupling = _RING_COUPLINGS.get(key)
+        if ring_coupling is None:
+            ring_coupling = RingCoupling(num_groups, num_spins_per_group, nu, mode, use_shared_memory=use_shared_memory)
+            _RING_COUPLINGS[key] = ring_coupling
+        return ring_coupling
+
+    def _table(self, key, array):
+        array = np.ascontiguousarray(array)
+        if self.use_shared_memory and array.nbytes > 0:
+            block = shared_memory.SharedMemory(create=True, size=array.nbytes)
+            self.owned_blocks.append(block)
+            table = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+            table[...] = array
+            self.shared_blocks[key] = block
+        else:
+            table = array
+        table.setflags(write=False)
+        return table
+
+    def _alias(self, key, source):
+        """The table of source, also shared under key."""
+        if source in self.shared_blocks:
+            self.shared_blocks[key] = self.shared_blocks[source]
+        return getattr(self, source)
+
+    def _attach(self, key, name, shape, dtype):
+        block = shared_memory.SharedMemory(name=name)
+        table = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        table.setflags(write=False)
+        self.shared_blocks[key] = block
+        return table
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["shared_blocks"] = {}
+        state["owned_blocks"] = []
+        for key in RingCoupling.TABLES:
+            block = self.shared_blocks.get(key)
+            if block is not None:
+                state[key] = ("shared_memory", block.name, state[key].shape, state[key].dtype.str)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        for key in RingCoupling.TABLES:
+            table = state.get(key)
+            if isinstance(table, tuple):
+                setattr(self, key, self._attach(key, *table[1:]))
+
+    def release(self):
+        """Unlink the shared memory blocks created by this instance."""
+        for block in self.owned_blocks:
+            block.unlink()
+        self.owned_blocks = []
+
+    def _expand(self, group_matrix):
+        n = self.num_spins_per_group
+        return np.repeat(np.repeat(group_matrix, n, axis=0), n, axis=1)
+
+    def dense_matrix(self):
+        if self._dense_matrix is None:
+            # first use may come in a forked worker, where a block would outlive the parent's release
+            self._dense_matrix = self._expand(self.group_matrix)
+            self._dense_matrix.setflags(write=False)
+        return self._dense_matrix
+
+    def field(self, state):
+        """Unscaled field J.s of a (..., groups, spins) state, per spin in dense mode and per group otherwise."""
+        if self.mode == "dense":
+            return state.reshape(state.shape[:-2] + (-1,)) @ self.row_matrix
+        counts = state.sum(axis=-1, dtype=np.float64)
+        if self.mode == "low_rank":
+            return ((counts @ self.eigenvectors) * self.eigenvalues) @ self.eigenvectors.T
+        return np.fft.irfft(np.fft.rfft(counts, axis=-1) * self.kernel_spectrum, n=self.num_groups, axis=-1)
+
+    def row(self, k):
+        """Change of the field when spin k goes from 0 to 1 (k may be an array of flat indices)."""
+        return self.row_matrix[self.field_index[k]]
+
+    def pair_sum(self, state):
+        """Sum of J_ij s_i s_j over the pairs i < j of a (groups, spins) state."""
+        field = self.field(state)
+        weights = state.ravel() if self.mode == "dense" else state.sum(axis=-1, dtype=np.float64)
+        return 0.5 * (float(weights @ field) - self.self_coupling * float(np.sum(state)))
+
+def release_shared_couplings():
+    """Unlink the shared memory owned by the cached couplings and empty the cache."""
+    for ring_coupling in _RING_COUPLINGS.values():
+        ring_coupling.release()
+    _RING_COUPLINGS.clear()
 
 class SpinSystem:
-    def __init__(self, random_generator, num_groups, num_spins_per_group, T, J, nu, p_spin_up=0.5, time_delay:int=1, dynamics='metropolis'):
+    def __init__(self, random_generator, num_groups, num_spins_per_group, T, J, nu, p_spin_up=0.5, time_delay:int=1, dynamics='metropolis', coupling_mode='auto', ring_coupling=None, rng_mode='numpy'):
+        if rng_mode not in ("numpy", "compat"):
+            raise ValueError(f"Unknown rng mode: {rng_mode}")
         self.random_generator = random_generator
+        # "compat" draws everything from random_generator exactly as the original implementation,
+        # "numpy" seeds a numpy Generator from it and draws sites and uniforms in blocks
+        self.rng_mode = rng_mode
+        if rng_mode == "numpy":
+            self.np_random = np.random.default_rng(Random.getrandbits(random_generator, 64))
+            self._site_block = []
+            self._uniform_block = []
+            self._draw_index = 0
         self.num_groups = num_groups
         self.num_spins_per_group = num_spins_per_group
         self.T = T
@@ -14,124 +179,402 @@ class SpinSystem:
         self.nu = nu
         self.p_spin_up = p_spin_up
         self.spins = self._random_spins()
-        self.spins_history = [self.spins.copy()]
         self.history_length = time_delay
+        self.spins_history = np.empty((self.history_length,) + self.spins.shape, dtype=np.uint8)
+        self.flips_history = np.full(self.history_length, _NO_FLIP, dtype=np.intp)
+        self._reset_history()
         self.dynamics = dynamics
-        group_angles = np.linspace(0, 2 * _PI, num_groups, endpoint=False)
-        self.angles = np.repeat(group_angles, self.num_spins_per_group)
+        if ring_coupling is None:
+            ring_coupling = RingCoupling.shared(num_groups, num_spins_per_group, nu, coupling_mode)
+        self.ring_coupling = ring_coupling
+        self.angles = ring_coupling.angles
         self.external_field = np.zeros(self.num_groups * self.num_spins_per_group, dtype=np.float32)
         self.avg_direction = None
-        self.J_matrix = self._precompute_j_matrix()
+        self.kmc_time = 0.0
+        self._reset_convergence()
+        self.coupling = self.J / (self.num_spins_per_group * self.num_groups)
+        self._refresh_local_fields()
+        self._refresh_activity()
+        self._refresh_group_external_field()
+        self._build_kmc_classes()
 
     def _random_spins(self):
-        rand_vals = np.array([Random.uniform(self.random_generator, 0, 1)
-                              for _ in range(self.num_groups * self.num_spins_per_group)])
+        if self.rng_mode == "numpy":
+            rand_vals = self.np_random.random(self.num_groups * self.num_spins_per_group)
+        else:
+            rand_vals = np.array([Random.uniform(self.random_generator, 0, 1)
+                                  for _ in range(self.num_groups * self.num_spins_per_group)])
         spins = (rand_vals < self.p_spin_up).astype(np.uint8)
         return spins.reshape(self.num_groups, self.num_spins_per_group)
 
-    def _precompute_j_matrix(self):
-        angle_diff_matrix = np.abs(np.subtract.outer(self.angles, self.angles))
-        angle_diff_matrix = np.minimum(angle_diff_matrix, 2 * _PI - angle_diff_matrix)
-        return np.cos(_PI * ((angle_diff_matrix / _PI) ** self.nu))
+    @property
+    def J_matrix(self):
+        return self.ring_coupling.dense_matrix()
+
+    def parameters(self) -> dict:
+        """The parameters the dynamics run with, defaults resolved."""
+        return {"num_groups": self.num_groups, "num_spins_per_group": self.num_spins_per_group, "T": self.T, "J": self.J,
+                "nu": self.nu, "p_spin_up": self.p_spin_up, "time_delay": self.history_length, "dynamics": self.dynamics,
+                "coupling": self.ring_coupling.mode, "rng": self.rng_mode}
 
     def set_p_spin_up(self, p_spin_up):
         self.p_spin_up = p_spin_up
 
+    def get_random_state(self):
+        if self.rng_mode == "compat":
+            return (self.random_generator.getstate(),)
+        return (self.random_generator.getstate(), self.np_random.bit_generator.state,
+                list(self._site_block), list(self._uniform_block), self._draw_index)
+
+    def set_random_state(self, random_state):
+        self.random_generator.setstate(random_state[0])
+        if self.rng_mode == "numpy":
+            self.np_random.bit_generator.state = random_state[1]
+            self._site_block = list(random_state[2])
+            self._uniform_block = list(random_state[3])
+            self._draw_index = random_state[4]
+
     def calculate_hamiltonian(self, state):
         state_flat = state.ravel()
-        interaction = state_flat[:, None] * state_flat[None, :]
-        H_spin_interactions = -(self.J / (self.num_spins_per_group * self.num_groups)) * np.sum(np.triu(self.J_matrix * interaction, 1))
+        H_spin_interactions = -self.coupling * self.ring_coupling.pair_sum(state)
         external_field_contribution = -np.dot(self.external_field, state_flat)
         return H_spin_interactions + external_field_contribution
 
+    def _interaction_field(self, state):
+        return self.coupling * self.ring_coupling.field(state)
+
+    def _refresh_local_fields(self):
+        # local_field is the coupling field generated by the current spins,
+        # delayed_field the one generated by the oldest state in the history.
+        self.local_field = self._interaction_field(self.spins)
+        self.delayed_field = self._interaction_field(self.get_delayed_states()) if self.history_length > 1 else self.local_field
+
+    def _delta_hamiltonian(self, k, reference_state, reference_field):
+        """Energy change of flipping site k, site k taken from the current spins and the others from the reference state."""
+        interaction = reference_field[self.ring_coupling.field_index[k]] - self.coupling * self.ring_coupling.self_coupling * reference_state.flat[k]
+        sign = 1 - 2 * int(self.spins.flat[k])
+        return -sign * float(interaction + self.external_field[k])
+
+    def _draw_site(self):
+        if self.rng_mode == "compat":
+            i = Random.randint(self.random_generator, 0, self.num_groups - 1)
+            j = Random.randint(self.random_generator, 0, self.num_spins_per_group - 1)
+            return i * self.num_spins_per_group + j
+        if self._draw_index == len(self._site_block):
+            self._site_block = self.np_random.integers(0, self.num_groups * self.num_spins_per_group, _DRAW_BLOCK).tolist()
+            self._uniform_block = self.np_random.random(_DRAW_BLOCK).tolist()
+            self._draw_index = 0
+        self._draw_index += 1
+        return self._site_block[self._draw_index - 1]
+
+    def _draw_uniform(self):
+        """Acceptance uniform of the last proposed site."""
+        if self.rng_mode == "compat":
+            return Random.uniform(self.random_generator, 0, 1)
+        return self._uniform_block[self._draw_index - 1]
+
     def step(self,timedelay=True, dt=0.1, tau=33):
-        i = Random.randint(self.random_generator, 0, self.num_groups - 1)
-        j = Random.randint(self.random_generator, 0, self.num_spins_per_group - 1)
-        if timedelay:
-            hybrid_state = self.spins_history[0].copy()
-            hybrid_state[i, j] = self.spins[i, j]
-            state_to_use = hybrid_state
+        if self.dynamics == 'kmc':
+            delta_h = self._kmc_event(timedelay, tau)
+            return 0.0 if delta_h is None else delta_h
+        k = self._draw_site()
+        if timedelay and self.history_length > 1:
+            delta_h = self._delta_hamiltonian(k, self.get_delayed_states(), self.delayed_field)
         else:
-            state_to_use = self.spins
-        current_hamiltonian = self.calculate_hamiltonian(state_to_use)
-        state_to_use[i, j] ^= 1
-        new_hamiltonian = self.calculate_hamiltonian(state_to_use)
-        delta_h = new_hamiltonian - current_hamiltonian
+            delta_h = self._delta_hamiltonian(k, self.spins, self.local_field)
         if self.dynamics == 'metropolis':
-            self._metropolis_acceptance(i, j, delta_h)
+            accepted = self._metropolis_acceptance(delta_h)
         elif self.dynamics == 'glauber':
-            self._glauber_acceptance(i, j, delta_h, dt, tau)
+            accepted = self._glauber_acceptance(delta_h, dt, tau)
         else:
             raise ValueError(f"Unknown dynamics type: {self.dynamics}")
-        self.spins_history.append(self.spins.copy())
-        if len(self.spins_history) > self.history_length:
-            self.spins_history.pop(0)
+        if accepted:
+            self._flip(k)
+        self._push_history(k if accepted else _NO_FLIP)
+        return delta_h if accepted else 0.0
+
+    def _flip(self, k):
+        sign = 1.0 - 2.0 * self.spins.flat[k]
+        self.spins.flat[k] ^= 1
+        self.local_field += (sign * self.coupling) * self.ring_coupling.row(k)
+        self.active_count += int(sign)
+        if self.active_count == 0:
+            self.activity_sum = 0j
+        else:
+            self.activity_sum += sign * complex(self.ring_coupling.unit_vectors[k])
+        if self.kmc_members is not None:
+            own = int(self.spins.flat[k])
+            self._move_kmc_site(k, 2 * own + (int(self.get_delayed_states().flat[k]) if self.history_length > 1 else own))
+
+    def _reset_history(self):
+        self.spins_history[0] = self.spins
+        self.flips_history[0] = _STATE_CHANGED
+        self.history_head = 0
+        self.history_count = 1
+
+    def _push_history(self, flip):
+        """Store the new state in the circular history; flip is the flat index changed by the step."""
+        if self.history_count < self.history_length:
+            slot = self.history_count
+            self.history_count += 1
+            expired = False
+        else:
+            slot = self.history_head
+            self.history_head = (self.history_head + 1) % self.history_length
+            expired = True
+        self.spins_history[slot] = self.spins
+        self.flips_history[slot] = flip
+        if expired and self.history_length > 1:
+            self._advance_delayed_field(self.flips_history[self.history_head])
 
-    def _metropolis_acceptance(self, i, j, delta_h):
-        if delta_h <= 0 or Random.uniform(self.random_generator, 0, 1) < math.exp(-delta_h / self.T):
-            self.spins[i, j] ^= 1
+    def get_delayed_states(self):
+        return self.spins_history[self.history_head]
 
-    def _glauber_acceptance(self, i, j, delta_h, dt, tau):
+    def _advance_delayed_field(self, flip):
+        if flip == _STATE_CHANGED:
+            self.delayed_field = self._interaction_field(self.get_delayed_states())
+            self._build_kmc_classes()
+        elif flip >= 0:
+            sign = 2.0 * self.get_delayed_states().flat[flip] - 1.0
+            self.delayed_field += (sign * self.coupling) * self.ring_coupling.row(flip)
+            if self.kmc_members is not None:
+                self._move_kmc_site(flip, 2 * int(self.spins.flat[flip]) + int(self.get_delayed_states().flat[flip]))
+
+    def _metropolis_acceptance(self, delta_h):
+        return delta_h <= 0 or self._draw_uniform() < math.exp(-delta_h / self.T)
+
+    def _glauber_acceptance(self, delta_h, dt, tau):
         G = self.num_groups
         N = self.num_spins_per_group
         acceptance_prob = (G * N * dt) / tau * (1 / (1 + math.exp(delta_h / self.T)))
         acceptance_prob = min(acceptance_prob, 1.0)
-        if Random.uniform(self.random_generator, 0, 1) < acceptance_prob:
-            self.spins[i, j] ^= 1
+        return self._draw_uniform() < acceptance_prob
+
+    def _kmc_rates(self, timedelay, tau):
+        """Continuous time glauber rate of every site, 1 / (tau * (1 + exp(dH / T))), and its dH."""
+        if timedelay and self.history_length > 1:
+            reference_state, reference_field = self.get_delayed_states(), self.delayed_field
+        else:
+            reference_state, reference_field = self.spins, self.local_field
+        interaction = reference_field[self.ring_coupling.field_index] - self.coupling * self.ring_coupling.self_coupling * reference_state.ravel()
+        delta_h = -(1.0 - 2.0 * self.spins.ravel()) * (interaction + self.external_field)
+        return 0.5 * (1.0 - np.tanh(delta_h / (2 * self.T))) / tau, delta_h
+
+    def _kmc_class_rates(self, timedelay, tau):
+        """(groups, 4) rates and dH of the kmc site classes, same values as _kmc_rates for their sites."""
+        delayed = timedelay and self.history_length > 1
+        reference_field = self.delayed_field if delayed else self.local_field
+        group_field = reference_field[self.ring_coupling.field_index[::self.num_spins_per_group]]
+        reference = _KMC_REFERENCE if delayed else _KMC_OWN
+        interaction = group_field[:, None] - self.coupling * self.ring_coupling.self_coupling * reference
+        delta_h = -(1.0 - 2.0 * _KMC_OWN) * (interaction + self.group_external_field[:, None])
+        return 0.5 * (1.0 - np.tanh(delta_h / (2 * self.T))) / tau, delta_h
+
+    def _build_kmc_classes(self):
+        """Sort the sites of every group into the classes 2 * own spin + delayed spin (own spin twice
+        without delay): the sites of a class share one rate as long as the external field is uniform
+        in each group, as the perception sets it."""
+        if self.dynamics != 'kmc':
+            self.kmc_members = None
+            return
+        own = self.spins.ravel().astype(int)
+        reference = self.get_delayed_states().ravel().astype(int) if self.history_length > 1 else own
+        self.kmc_members = [[[] for _ in range(4)] for _ in range(self.num_groups)]
+        self.kmc_counts = np.zeros((self.num_groups, 4))
+        self.kmc_class = (2 * own + reference).tolist()
+        self.kmc_slot = [0] * own.size
+        for k, c in enumerate(self.kmc_class):
+            g = k // self.num_spins_per_group
+            self.kmc_slot[k] = len(self.kmc_members[g][c])
+            self.kmc_members[g][c].append(k)
+            self.kmc_counts[g, c] += 1
+
+    def _move_kmc_site(self, k, new_class):
+        old_class = self.kmc_class[k]
+        if old_class == new_class:
+            return
+        g = k // self.num_spins_per_group
+        members = self.kmc_members[g][old_class]
+        last = members.pop()
+        if last != k:
+            members[self.kmc_slot[k]] = last
+            self.kmc_slot[last] = self.kmc_slot[k]
+        members = self.kmc_members[g][new_class]
+        self.kmc_slot[k] = len(members)
+        members.append(k)
+        self.kmc_class[k] = new_class
+        self.kmc_counts[g, old_class] -= 1
+        self.kmc_counts[g, new_class] += 1
+
+    def _kmc_uniforms(self):
+        if self.rng_mode == "compat":
+            return Random.uniform(self.random_generator, 0, 1), Random.uniform(self.random_generator, 0, 1)
+        u_time, u_site = self.np_random.random(2)
+        return u_time, u_site
+
+    def _kmc_advance(self, u_time, total, horizon):
+        """Advance kmc_time by the exponential waiting time of total; False if no event happens before horizon."""
+        wait = -math.log(1.0 - u_time) / total if total > 0 else math.inf
+        if horizon is not None and self.kmc_time + wait > horizon:
+            self.kmc_time = horizon
+            return False
+        if total <= 0:
+            return False
+        self.kmc_time += wait
+        return True
+
+    def _kmc_event(self, timedelay, tau, horizon=None):
+        """Rejection-free step: flip one spin chosen with probability proportional to its rate.
+
+        The simulated time kmc_time advances by an exponential waiting time of the total rate.
+        Returns the energy change of the flip, or None without flipping when the waiting time
+        would cross horizon (kmc_time is then set to horizon) or when no spin can flip.
+
+        A flip changes the field of every group, so the (groups, 4) class rates are recomputed
+        at each event and the site is drawn uniformly among the members of the selected class:
+        O(groups) per event instead of O(groups * spins).
+        """
+        if self.group_external_field is None:
+            return self._kmc_site_event(timedelay, tau, horizon)
+        rates, delta_h = self._kmc_class_rates(timedelay, tau)
+        class_totals = rates * self.kmc_counts
+        group_totals = np.cumsum(class_totals.sum(axis=1))
+        total = float(group_totals[-1])
+        u_time, u_site = self._kmc_uniforms()
+        if not self._kmc_advance(u_time, total, horizon):
+            return None
+        target = u_site * total
+        g = min(int(np.searchsorted(group_totals, target, side='right')), self.num_groups - 1)
+        target -= float(group_totals[g - 1]) if g > 0 else 0.0
+        chosen = None
+        for c, class_total in enumerate(class_totals[g].tolist()):
+            if class_total <= 0:
+                continue
+            chosen = c
+            if target < class_total:
+                break
+            target -= class_total
+        if chosen is None:
+            return None
+        members = self.kmc_members[g][chosen]
+        k = members[min(int(target / rates[g, chosen]), len(members) - 1)]
+        flip_delta_h = float(delta_h[g, chosen])
+        self._flip(k)
+        self._push_history(k)
+        return flip_delta_h
+
+    def _kmc_site_event(self, timedelay, tau, horizon=None):
+        """_kmc_event from the rates of every site, for external fields that differ within a group."""
+        rates, delta_h = self._kmc_rates(timedelay, tau)
+        rates = rates.reshape(self.num_groups, self.num_spins_per_group)
+        group_totals = np.cumsum(rates.sum(axis=1))
+        total = float(group_totals[-1])
+        u_time, u_site = self._kmc_uniforms()
+        if not self._kmc_advance(u_time, total, horizon):
+            return None
+        target = u_site * total
+        i = min(int(np.searchsorted(group_totals, target, side='right')), self.num_groups - 1)
+        target -= float(group_totals[i - 1]) if i > 0 else 0.0
+        j = min(int(np.searchsorted(np.cumsum(rates[i]), target, side='right')), self.num_spins_per_group - 1)
+        k = i * self.num_spins_per_group + j
+        self._flip(k)
+        self._push_history(k)
+        return float(delta_h[k])
 
     def run_spins(self, steps=1, dt=0.1, tau=33):
+        if self.dynamics == 'kmc':
+            # steps glauber proposals on a ring of N spins stand for steps * dt of simulated time:
+            # a proposal picks a site with probability 1 / N and accepts it with probability
+            # N * dt / tau / (1 + exp(dH / T)), i.e. each site flips at rate 1 / (tau * (1 + exp(dH / T)))
+            # the history, and so time_delay, still counts kmc events, not simulated time
+            horizon = self.kmc_time + steps * dt
+            while self._kmc_event(True, tau, horizon) is not None:
+                pass
+            return self.spins
         for _ in range(steps):
             self.step(dt=dt, tau=tau)
         return self.spins
 
+    def run_spins_adaptive(self, min_steps, max_steps, window=32, tolerance=0.01, dt=0.1, tau=33):
+        """Run at least min_steps and at most max_steps steps, stopping as soon as the energy
+        change of the accepted flips over the last window steps averages below tolerance.
+        The window slides across calls, so short ticks fill it together.
+        Returns the number of steps run; kmc always simulates max_steps * dt time units."""
+        if self.dynamics == 'kmc':
+            self.run_spins(max_steps, dt, tau)
+            return max_steps
+        if self.energy_window is None or len(self.energy_window) != window:
+            self._reset_convergence(window)
+        energy_changes = self.energy_window
+        for n in range(max_steps):
+            delta = self.step(dt=dt, tau=tau)
+            slot = self.window_position
+            self.window_drift += delta - energy_changes[slot]
+            energy_changes[slot] = delta
+            self.window_position = (slot + 1) % window
+            if self.window_position == 0:
+                # resum once per lap so the rounding errors of the running drift do not pile up
+                self.window_drift = math.fsum(energy_changes)
+            self.window_count = min(self.window_count + 1, window)
+            if n + 1 >= min_steps and self.window_count == window and abs(self.window_drift) <= tolerance * window:
+                return n + 1
+        return max_steps
+
+    def _reset_convergence(self, window=None):
+        """Forget the energy changes of the convergence window, e.g. when the spins are replaced."""
+        self.energy_window = None if window is None else [0.0] * window
+        self.window_position = 0
+        self.window_count = 0
+        self.window_drift = 0.0
+
+    def _refresh_activity(self):
+        # running sum of the unit vectors of the active spins and their number, updated by _flip
+        active_mask = self.spins.ravel() == 1
+        self.activity_sum = complex(np.sum(self.ring_coupling.unit_vectors[active_mask]))
+        self.active_count = int(np.count_nonzero(active_mask))
+
     def average_direction_of_activity(self):
-        flattened_spins = self.spins.ravel()
-        if np.all(flattened_spins == 1):
-            self.avg_direction = None
-            return None
-        unit_vectors = np.exp(1j * self.angles)
-        active_mask = flattened_spins == 1
-        if not np.any(active_mask):
+        if self.active_count == 0 or self.active_count == self.spins.size or self.activity_sum == 0:
             self.avg_direction = None
-            return None
-        sum_vector = np.sum(unit_vectors[active_mask])
-        if sum_vector != 0:
-            self.avg_direction = math.atan2(sum_vector.imag, sum_vector.real)
         else:
-            self.avg_direction = None
+            self.avg_direction = math.atan2(self.activity_sum.imag, self.activity_sum.real)
         return self.avg_direction
 
     def get_avg_direction_of_activity(self):
         return self.avg_direction
 
     def get_inverse_magnitude_of_activity(self):
-        flattened_spins = self.spins.ravel()
-        unit_vectors = np.exp(1j * self.angles)
-        active_mask = flattened_spins == 1
-        if not np.any(active_mask):
+        magnitude = abs(self.activity_sum)
+        if self.active_count == 0 or magnitude == 0:
             return float('inf')
-        sum_vector = np.sum(unit_vectors[active_mask])
-        magnitude = abs(sum_vector)
-        return 1 / magnitude if magnitude != 0 else float('inf')
+        return 1 / magnitude
 
     def get_width_of_activity(self):
-        flattened_spins = self.spins.ravel()
-        active_mask = flattened_spins == 1
-        active_angles = self.angles[active_mask]
-        if len(active_angles) > 1:
-            unit_vectors = np.exp(1j * active_angles)
-            R = abs(np.mean(unit_vectors))
+        if self.active_count > 1:
+            R = abs(self.activity_sum) / self.active_count
             if R > 0:
-                circ_std = math.sqrt(-2 * math.log(R))
-                return circ_std
+                return math.sqrt(max(-2 * math.log(R), 0.0))
         return None
 
     def reset_spins(self):
         self.spins = self._random_spins()
-        self.spins_history = [self.spins.copy()]
+        self._reset_history()
+        self._reset_convergence()
+        self._refresh_local_fields()
+        self._refresh_activity()
+        self._build_kmc_classes()
 
     def update_external_field(self, perceptual_outputs):
         self.external_field = np.asarray(perceptual_outputs, dtype=np.float32)
+        self._refresh_group_external_field()
+
+    def _refresh_group_external_field(self):
+        # per group external field of the kmc site classes, None when it differs within a group
+        self.group_external_field = None
+        if self.dynamics == 'kmc':
+            field = self.external_field.reshape(self.num_groups, self.num_spins_per_group)
+            if np.all(field == field[:, :1]):
+                self.group_external_field = field[:, 0].astype(np.float64)
 
     def get_states(self):
         return self.spins
@@ -146,9 +589,172 @@ class SpinSystem:
         if states.shape != self.spins.shape:
             raise ValueError(f"Invalid shape for spin states. Expected {self.spins.shape}, but got {states.shape}.")
         self.spins = states.copy()
-        self.spins_history.append(self.spins.copy())
-        if len(self.spins_history) > self.history_length:
-            self.spins_history.pop(0)
+        self._reset_convergence()
+        self.local_field = self._interaction_field(self.spins)
+        if self.history_length == 1:
+            self.delayed_field = self.local_field
+        self._refresh_activity()
+        self._push_history(_STATE_CHANGED)
+        self._build_kmc_classes()
 
     def sense_other_ring(self, other_ring_states, gain=1.0):
-        self.external_field = gain * np.asarray(other_ring_states, dtype=np.float32).ravel()
\ No newline at end of file
+        self.external_field = gain * np.asarray(other_ring_states, dtype=np.float32).ravel()
+        self._refresh_group_external_field()
+
+class BatchedSpinSystem:
+    """Steps the spin rings of a whole population of agents sharing the same spin parameters.
+
+    Spins are stored as one (agents, groups, spins_per_group) array, angles and ring coupling
+    are shared and every agent keeps its own external field. Each step proposes one flip
+    per agent and draws sites and acceptance uniforms for all agents at once.
+    """
+
+    def __init__(self, spin_systems, seed=None):
+        if not spin_systems:
+            raise ValueError("BatchedSpinSystem requires at least one spin system")
+        ref = spin_systems[0]
+        if ref.dynamics == 'kmc':
+            raise ValueError("kmc dynamics is not supported by BatchedSpinSystem")
+        for system in spin_systems:
+            if (system.num_groups, system.num_spins_per_group, system.T, system.J, system.nu, system.history_length, system.dynamics, system.ring_coupling.mode) != \
+               (ref.num_groups, ref.num_spins_per_group, ref.T, ref.J, ref.nu, ref.history_length, ref.dynamics, ref.ring_coupling.mode):
+                raise ValueError("All spin systems in a batch must share the same spin parameters")
+        self.rng = np.random.default_rng(seed)
+        self.num_agents = len(spin_systems)
+        self.num_groups = ref.num_groups
+        self.num_spins_per_group = ref.num_spins_per_group
+        self.size = self.num_groups * self.num_spins_per_group
+        self.T = ref.T
+        self.J = ref.J
+        self.nu = ref.nu
+        self.history_length = ref.history_length
+        self.dynamics = ref.dynamics
+        self.angles = ref.angles
+        self.ring_coupling = ref.ring_coupling
+        self.coupling = ref.coupling
+        self.unit_vectors = self.ring_coupling.unit_vectors
+        self.spins = np.stack([system.get_states() for system in spin_systems]).astype(np.uint8)
+        self.flat_spins = self.spins.reshape(self.num_agents, self.size)
+        self.external_field = np.stack([system.get_external_field() for system in spin_systems]).astype(np.float32)
+        self.local_field = self.coupling * self.ring_coupling.field(self.spins)
+        self._rows = np.arange(self.num_agents)
+        self.activity_sums = self.flat_spins @ self.unit_vectors
+        self.active_counts = np.count_nonzero(self.flat_spins, axis=1)
+        self._reset_history()
+
+    def _reset_history(self):
+        if self.history_length > 1:
+            self.delayed_spins = self.flat_spins.copy()
+            self.delayed_field = self.local_field.copy()
+            self.flips_history = np.full((self.history_length - 1, self.num_agents), -1, dtype=np.intp)
+            self.history_head = 0
+        else:
+            self.delayed_spins = self.flat_spins
+            self.delayed_field = self.local_field
+
+    def view(self, index):
+        return SpinSystemView(self, index)
+
+    def update_external_field(self, index, perceptual_outputs):
+        self.external_field[index] = np.asarray(perceptual_outputs, dtype=np.float32)
+
+    def step(self, timedelay=True, dt=0.1, tau=33):
+        rows = self._rows
+        sites = self.rng.integers(0, self.size, self.num_agents)
+        uniforms = self.rng.random(self.num_agents)
+        if timedelay and self.history_length > 1:
+            reference_state, reference_field = self.delayed_spins, self.delayed_field
+        else:
+            reference_state, reference_field = self.flat_spins, self.local_field
+        interaction = reference_field[rows, self.ring_coupling.field_index[sites]] - self.coupling * self.ring_coupling.self_coupling * reference_state[rows, sites]
+        sign = 1.0 - 2.0 * self.flat_spins[rows, sites]
+        delta_h = -sign * (interaction + self.external_field[rows, sites])
+        with np.errstate(over='ignore'):
+            if self.dynamics == 'metropolis':
+                accepted = (delta_h <= 0) | (uniforms < np.exp(-delta_h / self.T))
+            elif self.dynamics == 'glauber':
+                acceptance_prob = (self.size * dt) / tau * (1 / (1 + np.exp(delta_h / self.T)))
+                accepted = uniforms < np.minimum(acceptance_prob, 1.0)
+            else:
+                raise ValueError(f"Unknown dynamics type: {self.dynamics}")
+        flips = np.where(accepted, sites, -1)
+        self._apply_flips(self.flat_spins, self.local_field, flips)
+        self.active_counts += (sign * accepted).astype(self.active_counts.dtype)
+        self.activity_sums += np.where(accepted, sign * self.unit_vectors[sites], 0)
+        self.activity_sums[self.active_counts == 0] = 0
+        if self.history_length > 1:
+            expired = self.flips_history[self.history_head].copy()
+            self.flips_history[self.history_head] = flips
+            self.history_head = (self.history_head + 1) % (self.history_length - 1)
+            self._apply_flips(self.delayed_spins, self.delayed_field, expired)
+
+    def _apply_flips(self, state, field, flips):
+        rows = np.flatnonzero(flips >= 0)
+        if rows.size == 0:
+            return
+        sites = flips[rows]
+        sign = 1.0 - 2.0 * state[rows, sites]
+        state[rows, sites] ^= 1
+        field[rows] += (sign * self.coupling)[:, None] * self.ring_coupling.row(sites)
+
+    def run_spins(self, steps=1, dt=0.1, tau=33):
+        for _ in range(steps):
+            self.step(dt=dt, tau=tau)
+        return self.spins
+
+    def activity(self):
+        """Complex sum of the active unit vectors and number of active spins, per agent."""
+        return self.activity_sums, self.active_counts
+
+    def get_angles(self):
+        return (self.angles, self.num_groups, self.num_spins_per_group)
+
+
+class SpinSystemView:
+    """Read access to one agent of a BatchedSpinSystem through the SpinSystem interface."""
+
+    def __init__(self, batch, index):
+        self.batch = batch
+        self.index = index
+        self.avg_direction = None
+
+    def average_direction_of_activity(self):
+        sums, counts = self.batch.activity()
+        count = counts[self.index]
+        sum_vector = sums[self.index]
+        if count == 0 or count == self.batch.size or sum_vector == 0:
+            self.avg_direction = None
+        else:
+            self.avg_direction = math.atan2(sum_vector.imag, sum_vector.real)
+        return self.avg_direction
+
+    def get_avg_direction_of_activity(self):
+        return self.avg_direction
+
+    def get_inverse_magnitude_of_activity(self):
+        sums, counts = self.batch.activity()
+        magnitude = abs(sums[self.index])
+        if counts[self.index] == 0 or magnitude == 0:
+            return float('inf')
+        return 1 / magnitude
+
+    def get_width_of_activity(self):
+        sums, counts = self.batch.activity()
+        count = counts[self.index]
+        if count > 1:
+            R = abs(sums[self.index]) / count
+            if R > 0:
+                return math.sqrt(max(-2 * math.log(R), 0.0))
+        return None
+
+    def update_external_field(self, perceptual_outputs):
+        self.batch.update_external_field(self.index, perceptual_outputs)
+
+    def get_states(self):
+        return self.batch.spins[self.index]
+
+    def get_external_field(self):
+        return self.batch.external_field[self.index]
+
+    def get_angles(self):
+        return self.batch.get_angles()
@@ -0,0 +1,92 @@
+import math
+import numpy as np
+from bodies.shapes3D import Cylinder, Cuboid, Sphere
+
+_FIELDS = {}
+_MAX_FIELDS = 8
+
+class StaticField:
+    """Signed distance to the static geometry, the arena walls and the object footprints, on a grid.
+
+    The distance is positive in free space (inside the arena and outside every object) and
+    negative past a wall or inside an object. Nodes are resolution apart over the arena
+    bounds plus a margin, and sample() interpolates distance and gradient bilinearly.
+    """
+    def __init__(self, arena_shape, object_shapes, resolution:float, margin:float=0.0):
+        self.resolution = float(resolution)
+        (lo_x, lo_y, _), (hi_x, hi_y, _) = arena_shape.bounds()
+        for shape in object_shapes:
+            (o_lo_x, o_lo_y, _), (o_hi_x, o_hi_y, _) = shape.bounds()
+            lo_x, lo_y = min(lo_x, o_lo_x), min(lo_y, o_lo_y)
+            hi_x, hi_y = max(hi_x, o_hi_x), max(hi_y, o_hi_y)
+        margin = margin + 2 * self.resolution
+        self.x0, self.y0 = lo_x - margin, lo_y - margin
+        nx = int(math.ceil((hi_x + margin - self.x0) / self.resolution)) + 1
+        ny = int(math.ceil((hi_y + margin - self.y0) / self.resolution)) + 1
+        xs = self.x0 + np.arange(nx) * self.resolution
+        ys = self.y0 + np.arange(ny) * self.resolution
+        px, py = np.meshgrid(xs, ys, indexing="ij")
+        distance = np.full((nx, ny), np.inf)
+        if arena_shape._id in ("circle", "rectangle", "square"):
+            distance = -_footprint_distance(arena_shape, px, py)
+        for shape in object_shapes:
+            object_distance = _footprint_distance(shape, px, py)
+            if object_distance is not None:
+                distance = np.minimum(distance, object_distance)
+        self.distance = distance
+        self.gradient_x, self.gradient_y = np.gradient(distance, self.resolution)
+
+    @staticmethod
+    def layout_key(arena_shape, object_shapes, resolution:float):
+        """Everything the field depends on: the shapes, their dimensions and their positions."""
+        shapes = [arena_shape] + list(object_shapes)
+        return (float(resolution),) + tuple((shape._id, shape.template_key(), shape.center.x, shape.center.y) for shape in shapes)
+
+    @staticmethod
+    def shared(arena_shape, object_shapes, resolution:float, margin:float=0.0):
+        """Field of the layout, built once and reused while the layout repeats (e.g. across runs)."""
+        key = StaticField.layout_key(arena_shape, object_shapes, resolution) + (float(margin),)
+        field = _FIELDS.get(key)
+        if field is None:
+            field = StaticField(arena_shape, object_shapes, resolution, margin)
+            if len(_FIELDS) >= _MAX_FIELDS:
+                del _FIELDS[next(iter(_FIELDS))]
+            _FIELDS[key] = field
+        return field
+
+    def sample(self, xs, ys):
+        """Bilinear distance and gradient at the points (xs, ys), clamped to the grid."""
+        nx, ny = self.distance.shape
+        fx = (np.asarray(xs, dtype=float) - self.x0) / self.resolution
+        fy = (np.asarray(ys, dtype=float) - self.y0) / self.resolution
+        i = np.clip(np.floor(fx).astype(np.intp), 0, nx - 2)
+        j = np.clip(np.floor(fy).astype(np.intp), 0, ny - 2)
+        tx = np.clip(fx - i, 0.0, 1.0)
+        ty = np.clip(fy - j, 0.0, 1.0)
+        w00, w10 = (1 - tx) * (1 - ty), tx * (1 - ty)
+        w01, w11 = (1 - tx) * ty, tx * ty
+        def interpolate(grid):
+            return w00 * grid[i, j] + w10 * grid[i + 1, j] + w01 * grid[i, j + 1] + w11 * grid[i + 1, j + 1]
+        return interpolate(self.distance), interpolate(self.gradient_x), interpolate(self.gradient_y)
+
+
+def footprint_radius(shape) -> float:
+    """Radius of the disc the field tests a shape with: its own radius, or half its widest side."""
+    radius = shape.get_radius()
+    if radius > 0:
+        return radius
+    (lo_x, lo_y, _), (hi_x, hi_y, _) = shape.bounds()
+    return max(hi_x - lo_x, hi_y - lo_y) * 0.5
+
+def _footprint_distance(shape, px, py):
+    """Signed distance from the footprint of shape in the xy plane, None for shapes without one."""
+    if isinstance(shape, (Cylinder, Sphere)):
+        return np.hypot(px - shape.center.x, py - shape.center.y) - shape.radius
+    if isinstance(shape, Cuboid):
+        (lo_x, lo_y, _), (hi_x, hi_y, _) = shape.bounds()
+        cx, cy = (lo_x + hi_x) * 0.5, (lo_y + hi_y) * 0.5
+        qx = np.abs(px - cx) - (hi_x - lo_x) * 0.5
+        qy = np.abs(py - cy) - (hi_y - lo_y) * 0.5
+        outside = np.hypot(np.maximum(qx, 0.0), np.maximum(qy, 0.0))
+        return outside + np.minimum(np.maximum(qx, qy), 0.0)
+    return None
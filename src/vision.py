@@ -0,0 +1,155 @@
+import math
+import numpy as np
+from agentstate import AgentStateStore
+
+class BatchedVision:
+    """Visual fields and eq. (3)/(4) updates of all the vision agents of one type, as array operations.
+
+    Every agent perceives the positions of the other agents at the start of the tick,
+    while the sequential vision_routine sees the agents already moved in the same tick.
+    """
+    def __init__(self, entities):
+        first = entities[0]
+        self.entities = entities
+        self.num_agents = len(entities)
+        self.num_bins = first.visual_bins
+        self.angles = np.linspace(-math.pi, math.pi, self.num_bins, endpoint=False)
+        self.bin_width = 2 * math.pi / self.num_bins
+        self.cos_angles = np.cos(self.angles)
+        self.sin_angles = np.sin(self.angles)
+        self.visual_mode = first.visual_mode
+        self.object_size = max(1e-6, first.body_length)
+        agent_diameter = first.shape.diameter if hasattr(first.shape, 'diameter') else 0.033
+        self.agent_size = max(1e-6, agent_diameter)
+        self.perception_radius = first.perception_radius
+        self.alpha0, self.alpha1 = first.alpha0, first.alpha1
+        self.beta0, self.beta1 = first.beta0, first.beta1
+        self.gamma = first.gamma
+        self.v0_pref = first.v0_pref
+        self.max_absolute_velocity = first.max_absolute_velocity
+        self.dt = 1.0 / float(first.ticks_per_second)
+
+    def _relative_targets(self, rows, dx, dy, dist, orientations, size):
+        """Egocentric bearing and angular half size of the targets seen by rows."""
+        rel_angles = ((np.arctan2(-dy, dx) - orientations[rows]) + math.pi) % (2 * math.pi) - math.pi
+        with np.errstate(divide="ignore"):
+            half_angles = np.where(dist <= 1e-9, math.pi, np.arctan((size / 2.0) / dist))
+        return rel_angles, half_angles
+
+    def _covered_intervals(self, rel_angles, half_angles):
+        """First bin and number of consecutive (wrapped) bins within half_angle of each bearing."""
+        B = self.num_bins
+        centre = (rel_angles + math.pi) / self.bin_width
+        spread = half_angles / self.bin_width
+        first = np.ceil(centre - spread).astype(np.intp)
+        count = np.floor(centre + spread).astype(np.intp) - first + 1
+        full = half_angles >= math.pi
+        count = np.where(full, B, np.clip(count, 0, B))
+        first = np.where(full, 0, first) % B
+        return first, count
+
+    def _scatter(self, rows, rel_angles, half_angles, weights):
+        """Per agent and bin, number of covering targets and sum of their weights."""
+        B = self.num_bins
+        first, count = self._covered_intervals(rel_angles, half_angles)
+        keep = count > 0
+        rows, first, count, weights = rows[keep], first[keep], count[keep], weights[keep]
+        end = first + count
+        wrap = end > B
+        stride = B + 1
+        # interval [first, end) as +w at first and -w at end of a (agents, bins + 1) difference array
+        index = np.concatenate((rows * stride + first, rows * stride + np.minimum(end, B),
+                                rows[wrap] * stride, rows[wrap] * stride + end[wrap] - B))
+        signs = np.concatenate((np.ones(len(rows)), -np.ones(len(rows)),
+                                np.ones(int(wrap.sum())), -np.ones(int(wrap.sum()))))
+        size = self.num_agents * stride
+        counts = np.bincount(index, signs, size).reshape(self.num_agents, stride)[:, :B]
+        sums = np.bincount(index, signs * np.concatenate((weights, weights, weights[wrap], weights[wrap])), size)
+        sums = sums.reshape(self.num_agents, stride)[:, :B]
+        return np.rint(np.cumsum(counts, axis=1)) > 0, np.cumsum(sums, axis=1)
+
+    def _agent_pairs(self, xs, ys, target_xs, target_ys, self_index):
+        """Observer and target indices of the agents within perception_radius.
+
+        Targets are sorted by grid cell (cell side perception_radius), so each observer only
+        visits the targets of its own and the 8 neighbouring cells.
+        """
+        cell = max(self.perception_radius, 1e-6)
+        target_cx = np.floor(target_xs / cell).astype(np.int64)
+        target_cy = np.floor(target_ys / cell).astype(np.int64)
+        cx = np.floor(xs / cell).astype(np.int64)
+        cy = np.floor(ys / cell).astype(np.int64)
+        min_x, min_y = min(target_cx.min(), cx.min()) - 1, min(target_cy.min(), cy.min()) - 1
+        span = max(target_cy.max(), cy.max()) - min_y + 2
+        keys = (target_cx - min_x) * span + (target_cy - min_y)
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        rows, cols = [], []
+        for ox in (-1, 0, 1):
+            for oy in (-1, 0, 1):
+                query = (cx + ox - min_x) * span + (cy + oy - min_y)
+                lo = np.searchsorted(sorted_keys, query, "left")
+                counts = np.searchsorted(sorted_keys, query, "right") - lo
+                total = int(counts.sum())
+                if total == 0:
+                    continue
+                r = np.repeat(np.arange(self.num_agents), counts)
+                offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+                rows.append(r)
+                cols.append(order[np.repeat(lo, counts) + offsets])
+        if not rows:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+        rows, cols = np.concatenate(rows), np.concatenate(cols)
+        dist = np.hypot(target_xs[cols] - xs[rows], target_ys[cols] - ys[rows])
+        keep = (dist <= self.perception_radius) & (cols != self_index[rows])
+        return rows[keep], cols[keep]
+
+    def visual_fields(self, objects, all_entities):
+        """(agents, bins) matrix V of the visual fields, as built by MovableAgent.build_visual_field."""
+        positions = AgentStateStore.columns(self.entities, "position")
+        xs, ys = positions[:, 0], positions[:, 1]
+        orientations = np.radians(AgentStateStore.columns(self.entities, "orientation")[:, 2])
+        V = np.zeros((self.num_agents, self.num_bins))
+
+        positions = [pos for (_, obj_positions, _, _) in objects.values() for pos in obj_positions]
+        if positions:
+            object_xs = np.array([pos.x for pos in positions], dtype=float)
+            object_ys = np.array([pos.y for pos in positions], dtype=float)
+            rows = np.repeat(np.arange(self.num_agents), len(positions))
+            dx = np.tile(object_xs, self.num_agents) - xs[rows]
+            dy = np.tile(object_ys, self.num_agents) - ys[rows]
+            rel_angles, half_angles = self._relative_targets(rows, dx, dy, np.hypot(dx, dy), orientations, self.object_size)
+            covered, area = self._scatter(rows, rel_angles, half_angles, 2.0 * half_angles)
+            if self.visual_mode == "binary":
+                V[covered] = 1.0
+            else:
+                V = np.where(covered, area, 0.0)
+
+        index = {id(e): n for n, e in enumerate(all_entities)}
+        self_index = np.array([index[id(e)] for e in self.entities], dtype=np.intp)
+        target_positions = AgentStateStore.columns(all_entities, "position")
+        target_xs, target_ys = target_positions[:, 0], target_positions[:, 1]
+        rows, cols = self._agent_pairs(xs, ys, target_xs, target_ys, self_index)
+        if len(rows):
+            dx = target_xs[cols] - xs[rows]
+            dy = target_ys[cols] - ys[rows]
+            rel_angles, half_angles = self._relative_targets(rows, dx, dy, np.hypot(dx, dy), orientations, self.agent_size)
+            covered, _ = self._scatter(rows, rel_angles, half_angles, half_angles)
+            V[covered] = 1.0
+
+        if self.visual_mode == "binary":
+            V = np.minimum(V, 1.0)
+        return V
+
+    def step(self, objects, all_entities):
+        """Eq. (3) and (4) for all the agents: updates speed, orientation and forward_vector of each of them."""
+        V = self.visual_fields(objects, all_entities)
+        dV_dphi = np.gradient(V, self.bin_width, axis=1)
+        integral_acc = np.sum(self.cos_angles * (-V + self.alpha1 * dV_dphi ** 2), axis=1) * self.bin_width
+        integral_turn = np.sum(self.sin_angles * (-V + self.beta1 * dV_dphi ** 2), axis=1) * self.bin_width
+        speeds = np.array([e.speed for e in self.entities], dtype=float)
+        dv_dt = self.gamma * (self.v0_pref - speeds) + self.alpha0 * integral_acc
+        speeds = np.clip(speeds + dv_dt * self.dt, 0.0, self.max_absolute_velocity)
+        delta_deg = np.degrees(self.beta0 * integral_turn * self.dt)
+        for n, entity in enumerate(self.entities):
+            entity.apply_vision_update(V[n], float(speeds[n]), float(delta_deg[n]))
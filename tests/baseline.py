@@ -0,0 +1,122 @@
+"""Reference implementations from before the optimizations, the tests compare the current code against."""
+import math
+import numpy as np
+from random import Random
+
+_PI = math.pi
+
+class ReferenceSpinSystem:
+    """SpinSystem with the dense J matrix, full Hamiltonians and list history."""
+    def __init__(self, random_generator, num_groups, num_spins_per_group, T, J, nu, p_spin_up=0.5, time_delay:int=1, dynamics='metropolis'):
+        self.random_generator = random_generator
+        self.num_groups = num_groups
+        self.num_spins_per_group = num_spins_per_group
+        self.T = T
+        self.J = J
+        self.nu = nu
+        self.p_spin_up = p_spin_up
+        self.spins = self._random_spins()
+        self.spins_history = [self.spins.copy()]
+        self.history_length = time_delay
+        self.dynamics = dynamics
+        group_angles = np.linspace(0, 2 * _PI, num_groups, endpoint=False)
+        self.angles = np.repeat(group_angles, self.num_spins_per_group)
+        self.external_field = np.zeros(self.num_groups * self.num_spins_per_group, dtype=np.float32)
+        angle_diff_matrix = np.abs(np.subtract.outer(self.angles, self.angles))
+        angle_diff_matrix = np.minimum(angle_diff_matrix, 2 * _PI - angle_diff_matrix)
+        self.J_matrix = np.cos(_PI * ((angle_diff_matrix / _PI) ** self.nu))
+
+    def _random_spins(self):
+        rand_vals = np.array([Random.uniform(self.random_generator, 0, 1)
+                              for _ in range(self.num_groups * self.num_spins_per_group)])
+        return (rand_vals < self.p_spin_up).astype(np.uint8).reshape(self.num_groups, self.num_spins_per_group)
+
+    def calculate_hamiltonian(self, state):
+        state_flat = state.ravel()
+        interaction = state_flat[:, None] * state_flat[None, :]
+        H_spin_interactions = -(self.J / (self.num_spins_per_group * self.num_groups)) * np.sum(np.triu(self.J_matrix * interaction, 1))
+        return H_spin_interactions - np.dot(self.external_field, state_flat)
+
+    def delta_hamiltonian(self, i, j, timedelay=True):
+        """Energy change of flipping spin (i, j), the others taken from the delayed state with timedelay."""
+        if timedelay:
+            state = self.spins_history[0].copy()
+            state[i, j] = self.spins[i, j]
+        else:
+            state = self.spins.copy()
+        current = self.calculate_hamiltonian(state)
+        state[i, j] ^= 1
+        return self.calculate_hamiltonian(state) - current
+
+    def step(self, timedelay=True, dt=0.1, tau=33):
+        i = Random.randint(self.random_generator, 0, self.num_groups - 1)
+        j = Random.randint(self.random_generator, 0, self.num_spins_per_group - 1)
+        delta_h = self.delta_hamiltonian(i, j, timedelay)
+        if self.dynamics == 'metropolis':
+            if delta_h <= 0 or Random.uniform(self.random_generator, 0, 1) < math.exp(-delta_h / self.T):
+                self.spins[i, j] ^= 1
+        else:
+            acceptance_prob = (self.num_groups * self.num_spins_per_group * dt) / tau * (1 / (1 + math.exp(delta_h / self.T)))
+            if Random.uniform(self.random_generator, 0, 1) < min(acceptance_prob, 1.0):
+                self.spins[i, j] ^= 1
+        self.spins_history.append(self.spins.copy())
+        if len(self.spins_history) > self.history_length:
+            self.spins_history.pop(0)
+
+    def average_direction_of_activity(self):
+        active_mask = self.spins.ravel() == 1
+        if np.all(active_mask) or not np.any(active_mask):
+            return None
+        sum_vector = np.sum(np.exp(1j * self.angles)[active_mask])
+        return math.atan2(sum_vector.imag, sum_vector.real) if sum_vector != 0 else None
+
+    def reset_spins(self):
+        self.spins = self._random_spins()
+        self.spins_history = [self.spins.copy()]
+
+    def update_external_field(self, perceptual_outputs):
+        self.external_field = np.asarray(perceptual_outputs, dtype=np.float32)
+
+
+def reference_visual_field(agent, objects, all_entities):
+    """MovableAgent.build_visual_field looping over targets and bins, agents seen within 2 m."""
+    N = agent.visual_bins
+    V = np.zeros(N, dtype=float)
+    angles = np.linspace(-math.pi, math.pi, N, endpoint=False)
+    position = agent.get_position()
+    my_orient_rad = math.radians(agent.get_orientation().z)
+    targets = [(pos, max(1e-6, agent.body_length), False) for (_, positions, _, _) in objects.values() for pos in positions]
+    agent_diameter = agent.shape.diameter if hasattr(agent.shape, 'diameter') else 0.033
+    targets += [(other.get_position(), max(1e-6, agent_diameter), True) for other in all_entities if other is not agent]
+    for pos, size, is_agent in targets:
+        dx = pos.x - position.x
+        dy = pos.y - position.y
+        dist = math.hypot(dx, dy)
+        if is_agent and dist > 2.0:
+            continue
+        rel_angle = ((math.atan2(-dy, dx) - my_orient_rad) + math.pi) % (2 * math.pi) - math.pi
+        half_angle = math.pi if dist <= 1e-9 else math.atan((size / 2.0) / dist)
+        for k, phi_k in enumerate(angles):
+            diff = abs(((phi_k - rel_angle + math.pi) % (2 * math.pi)) - math.pi)
+            if diff <= half_angle:
+                if is_agent or agent.visual_mode == "binary":
+                    V[k] = 1.0
+                else:
+                    V[k] += 2.0 * half_angle
+    if agent.visual_mode == "binary":
+        V = np.minimum(V, 1.0)
+    return V
+
+
+def vertex_overlap(shape, other):
+    """check_overlap by testing the vertices of each shape against the other."""
+    for vertex in shape.vertices_list:
+        if other._object == "arena":
+            if not shape._is_point_inside_shape(vertex, other):
+                return True, vertex
+        elif shape._is_point_inside_shape(vertex, other):
+            return True, vertex
+    for vertex in other.vertices_list:
+        if shape._is_point_inside_shape(vertex, shape):
+            return True, vertex
+    return False, None
@@ -0,0 +1,34 @@
+import numpy as np
+from agentstate import AgentStateStore
+from entity import EntityFactory
+from geometry_utils.vector3D import Vector3D
+
+def _agents(number=4):
+    config = {"ticks_per_second": 2, "number": number, "linear_velocity": 0.1, "shape": "cylinder", "height": 0.02,
+              "diameter": 0.033, "moving_behavior": "random_walk"}
+    return [EntityFactory.create_entity("agent_movable_0", config, n) for n in range(number)]
+
+def test_gathered_rows_keep_agent_state():
+    agents = _agents()
+    for n, agent in enumerate(agents):
+        agent.position = Vector3D(n, -n, 0.5)
+        agent.forward_vector = Vector3D(1.0, 2.0, 0.0)
+    store = AgentStateStore.gather(agents)
+    for n, agent in enumerate(agents):
+        assert agent.state_store is store and agent.state_row == n
+        position = agent.position
+        assert (position.x, position.y, position.z) == (n, -n, 0.5)
+        # reads are copies, writes go to the row
+        position.x = 10.0
+        assert store.arrays["position"][n, 0] == n
+        agent.position = position
+        assert store.arrays["position"][n, 0] == 10.0
+    assert np.array_equal(AgentStateStore.columns(agents, "forward_vector"), np.tile([1.0, 2.0, 0.0], (len(agents), 1)))
+
+def test_integrate_moves_rows_by_their_time_step():
+    agents = _agents()
+    for agent in agents:
+        agent.forward_vector = Vector3D(0.2, 0.0, 0.0)
+    store = AgentStateStore.gather(agents)
+    store.integrate(np.array([1, 3]))
+    assert np.allclose(store.arrays["position"][:, 0], [0.0, 0.1, 0.0, 0.1])
@@ -0,0 +1,21 @@
+import numpy as np
+import pytest
+import perception
+from perception import PerceptionKernels
+
+@pytest.mark.parametrize("tolerance", [1e-3, 1e-2])
+def test_tabulated_kernels_within_tolerance(tolerance):
+    kernels = PerceptionKernels(32, 0.5, tolerance)
+    exact = PerceptionKernels(32, 0.5)
+    bearings = np.random.default_rng(0).uniform(-np.pi, np.pi, 500)
+    for width in (0.5, 0.6):
+        assert np.max(np.abs(kernels.kernels(bearings, width) - exact.kernels(bearings, width))) <= tolerance
+    assert all(table is False for table in exact.tables.values())
+
+def test_tables_are_bounded(monkeypatch):
+    monkeypatch.setattr(perception, "_MAX_TABLES", 4)
+    kernels = PerceptionKernels(16, 0.5, 1e-3)
+    for n in range(10):
+        kernels.kernels(np.zeros(3), 0.5 + 0.1 * n)
+    assert list(kernels.tables) == [0.5 + 0.1 * n for n in range(6, 10)]
+    assert kernels.table_bytes == sum(table.nbytes for table in kernels.tables.values())
@@ -0,0 +1,59 @@
+import math
+import random
+import pytest
+from bodies.shapes3D import Shape3DFactory
+from geometry_utils.vector3D import Vector3D
+from baseline import vertex_overlap
+
+def _shape(_object, kind, size, x, y, angle=0.0):
+    config = {"diameter": size, "height": 0.1} if kind == "circle" else {"width": size, "depth": size * 0.6, "height": 0.1}
+    shape = Shape3DFactory.create_shape(_object, kind, config)
+    shape.translate(Vector3D(x, y, 0.0))
+    shape.rotate(angle)
+    return shape
+
+def _inside(shape, x, y, tol=1e-9):
+    """Whether (x, y) lies in the footprint check_overlap tests: the disc, or the box bounds."""
+    if shape._footprint() == "circle":
+        return math.hypot(x - shape.center.x, y - shape.center.y) <= shape.radius + tol
+    lo, hi = shape.min_vert(), shape.max_vert()
+    return lo.x - tol <= x <= hi.x + tol and lo.y - tol <= y <= hi.y + tol
+
+def _sample(shape, n=24):
+    """Points covering the footprint of shape."""
+    lo, hi = shape.min_vert(), shape.max_vert()
+    points = [(lo.x + (hi.x - lo.x) * i / n, lo.y + (hi.y - lo.y) * j / n) for i in range(n + 1) for j in range(n + 1)]
+    return [p for p in points if _inside(shape, *p, tol=0.0)]
+
+@pytest.mark.parametrize("kinds", [("circle", "circle"), ("circle", "square"), ("square", "circle"), ("square", "square")])
+def test_pair_overlap_contract(kinds):
+    rng = random.Random(2)
+    for _ in range(300):
+        shape = _shape("agent", kinds[0], rng.uniform(0.03, 0.1), rng.uniform(-0.1, 0.1), rng.uniform(-0.1, 0.1), rng.uniform(0, 90))
+        other = _shape("object", kinds[1], rng.uniform(0.03, 0.1), rng.uniform(-0.1, 0.1), rng.uniform(-0.1, 0.1), rng.uniform(0, 90))
+        overlap, point = shape.check_overlap(other)
+        if vertex_overlap(shape, other)[0]:
+            # the closed form tests find every overlap vertex sampling found
+            assert overlap
+        if overlap:
+            assert _inside(shape, point.x, point.y) and _inside(other, point.x, point.y)
+        else:
+            assert not any(_inside(other, x, y, tol=0.0) for x, y in _sample(shape))
+
+@pytest.mark.parametrize("arena_kind", ["circle", "square"])
+@pytest.mark.parametrize("kind", ["circle", "square"])
+def test_arena_overlap_contract(arena_kind, kind):
+    rng = random.Random(4)
+    arena_config = {"diameter": 2.0, "height": 0.5} if arena_kind == "circle" else {"width": 2.0, "depth": 2.0, "height": 0.5}
+    arena = Shape3DFactory.create_shape("arena", arena_kind, arena_config)
+    for _ in range(300):
+        shape = _shape("agent", kind, rng.uniform(0.03, 0.2), rng.uniform(-1.1, 1.1), rng.uniform(-1.1, 1.1), rng.uniform(0, 90))
+        overlap, point = shape.check_overlap(arena)
+        if vertex_overlap(shape, arena)[0]:
+            assert overlap
+        if overlap:
+            # the contact point belongs to the shape and sticks out of the arena
+            assert _inside(shape, point.x, point.y)
+            assert not _inside(arena, point.x, point.y, tol=-1e-12)
+        else:
+            assert all(_inside(arena, x, y) for x, y in _sample(shape))
@@ -0,0 +1,50 @@
+import pickle
+import numpy as np
+import pytest
+from agentstate import AgentStateStore
+from entity import EntityFactory
+from sharedstate import SharedAgentState
+from geometry_utils.vector3D import Vector3D
+
+def _agents(number=3):
+    config = {"ticks_per_second": 1, "number": number, "linear_velocity": 0.1, "shape": "cylinder", "height": 0.02,
+              "diameter": 0.033, "moving_behavior": "random_walk"}
+    entities = [EntityFactory.create_entity("agent_movable_0", config, n) for n in range(number)]
+    AgentStateStore.gather(entities)
+    return {"agent_movable_0": (config, entities)}
+
+def _move(agents, x):
+    for n, entity in enumerate(agents["agent_movable_0"][1]):
+        entity.position = Vector3D(x, n, 0.0)
+
+def test_snapshot_returns_its_write_or_none():
+    agents = _agents()
+    state = SharedAgentState.from_agents(agents)
+    try:
+        writes = []
+        for x in range(SharedAgentState.SLOTS + 1):
+            _move(agents, x)
+            writes.append(state.write(agents))
+        latest = state.snapshot(writes[-1])
+        assert np.array_equal(latest["state"][:, 0:2], [[SharedAgentState.SLOTS, n] for n in range(3)])
+        # the first write shared its slot with the last one
+        assert state.snapshot(writes[0]) is None
+        assert state.snapshot(writes[1]) is not None
+        with pytest.raises(RuntimeError):
+            state.update_detector_data({}, writes[0])
+    finally:
+        state.release()
+
+def test_pickled_copy_attaches_to_the_block():
+    agents = _agents()
+    state = SharedAgentState.from_agents(agents)
+    try:
+        attached = pickle.loads(pickle.dumps(state))
+        assert not attached.owner
+        _move(agents, 2.5)
+        write = state.write(agents)
+        assert attached.snapshot(write)["state"][0, 0] == 2.5
+        attached.release()
+        assert state.snapshot(write) is not None
+    finally:
+        state.release()
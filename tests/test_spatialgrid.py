@@ -0,0 +1,36 @@
+import math
+import random
+import pytest
+from spatialgrid import SpatialGrid
+from collision_detector import bounding_radius
+from bodies.shapes3D import Shape3DFactory
+from geometry_utils.vector3D import Vector3D
+
+def _cells_in_reach(grid, pos, radius):
+    """SpatialGrid.candidates walking every cell in reach."""
+    cell_x, cell_y = grid._cell_coords(pos)
+    reach = max(1, math.ceil(radius / grid.cell_size))
+    return [item for dx in range(-reach, reach + 1) for dy in range(-reach, reach + 1) for item in grid.grid.get((cell_x + dx, cell_y + dy), [])]
+
+@pytest.mark.parametrize("number", [0, 3, 400])
+@pytest.mark.parametrize("cell_size", [1e-6, 0.05, 0.5])
+def test_candidates_cover_radius_in_cell_order(number, cell_size):
+    rng = random.Random(number)
+    points = [Vector3D(rng.uniform(-1, 1), rng.uniform(-1, 1), 0) for _ in range(number)]
+    grid = SpatialGrid(cell_size)
+    for n, point in enumerate(points):
+        grid.add(n, point)
+    for radius in (0.01, 0.1, 0.3):
+        pos = Vector3D(rng.uniform(-1, 1), rng.uniform(-1, 1), 0)
+        candidates = grid.candidates(pos, radius)
+        assert {n for n, point in enumerate(points) if (point - pos).magnitude() <= radius} <= set(candidates)
+        if cell_size >= 0.05:
+            assert candidates == _cells_in_reach(grid, pos, radius)
+
+def test_bounding_radius_of_boxes():
+    box = Shape3DFactory.create_shape("object", "square", {"width": 0.3, "depth": 0.4, "height": 0.1})
+    box.translate(Vector3D(1.0, -2.0, 0.0))
+    assert box.get_radius() == 0
+    assert bounding_radius(box) == pytest.approx(0.25)
+    disc = Shape3DFactory.create_shape("agent", "circle", {"diameter": 0.1, "height": 0.1})
+    assert bounding_radius(disc) == disc.get_radius()
@@ -0,0 +1,26 @@
+import random
+import numpy as np
+from spinsystem import SpinSystem
+from spincache import PreRunCache
+
+def _key(system, perception):
+    return PreRunCache.key({**system.parameters(), "spin_pre_run_steps": 100}, perception, system.get_random_state())
+
+def test_key_covers_resolved_parameters_and_version(monkeypatch):
+    perception = np.zeros(24)
+    low_rank = SpinSystem(random.Random(1), 8, 3, 0.5, 1.0, 0.0)
+    circulant = SpinSystem(random.Random(1), 8, 3, 0.5, 1.0, 0.0, coupling_mode="circulant")
+    # "auto" resolves to low_rank for nu=0: the same table, the same key
+    assert _key(low_rank, perception) == _key(SpinSystem(random.Random(1), 8, 3, 0.5, 1.0, 0.0, coupling_mode="low_rank"), perception)
+    assert _key(low_rank, perception) != _key(circulant, perception)
+    key = _key(low_rank, perception)
+    monkeypatch.setattr(PreRunCache, "VERSION", PreRunCache.VERSION + 1)
+    assert _key(low_rank, perception) != key
+
+def test_disk_tier_is_shared_across_instances(tmp_path):
+    writer = PreRunCache(0, str(tmp_path), disk_capacity=4)
+    writer.put("key", (0.25, None))
+    assert writer.entries == {}
+    reader = PreRunCache(0, str(tmp_path), disk_capacity=4)
+    assert reader.get("key") == (0.25, None)
+    assert reader.get("other") is None
@@ -0,0 +1,115 @@
+import pickle
+import random
+import numpy as np
+import pytest
+from spinsystem import SpinSystem, BatchedSpinSystem, RingCoupling
+from baseline import ReferenceSpinSystem
+
+PARAMS = [
+    # groups, spins per group, T, J, nu, time delay, dynamics, coupling mode
+    (8, 4, 0.5, 1.0, 0.0, 1, "metropolis", "auto"),
+    (8, 4, 0.5, 1.0, 0.5, 5, "metropolis", "circulant"),
+    (12, 3, 0.2, 2.0, 2.0, 3, "metropolis", "dense"),
+    (16, 2, 0.5, 1.0, 0.0, 4, "glauber", "low_rank"),
+    (6, 5, 1.0, 1.0, 1.0, 1, "glauber", "auto"),
+]
+
+def _pair(seed, groups, spins, T, J, nu, time_delay, dynamics, coupling_mode):
+    reference = ReferenceSpinSystem(random.Random(seed), groups, spins, T, J, nu, time_delay=time_delay, dynamics=dynamics)
+    system = SpinSystem(random.Random(seed), groups, spins, T, J, nu, time_delay=time_delay, dynamics=dynamics,
+                        coupling_mode=coupling_mode, rng_mode="compat")
+    field = np.random.default_rng(seed).normal(0.0, 0.3, groups * spins)
+    reference.update_external_field(field)
+    system.update_external_field(field)
+    return reference, system
+
+@pytest.mark.parametrize("params", PARAMS)
+def test_compat_trajectory_matches_reference(params):
+    reference, system = _pair(7, *params)
+    assert np.array_equal(system.get_states(), reference.spins)
+    for tick in range(60):
+        for _ in range(5):
+            reference.step()
+            system.step()
+            assert np.array_equal(system.get_states(), reference.spins)
+        assert system.average_direction_of_activity() == pytest.approx(reference.average_direction_of_activity())
+        if tick == 30:
+            reference.reset_spins()
+            system.reset_spins()
+
+@pytest.mark.parametrize("params", PARAMS)
+def test_energy_delta_matches_full_hamiltonian(params):
+    # the reference sums the float32 external field in float32, hence the tolerance
+    reference, system = _pair(11, *params)
+    spins = params[1]
+    for _ in range(40):
+        reference.step()
+        system.step()
+        for k in range(system.spins.size):
+            i, j = divmod(k, spins)
+            if system.history_length > 1:
+                delayed = system._delta_hamiltonian(k, system.get_delayed_states(), system.delayed_field)
+            else:
+                delayed = system._delta_hamiltonian(k, system.spins, system.local_field)
+            assert delayed == pytest.approx(reference.delta_hamiltonian(i, j, True), abs=1e-6)
+            assert system._delta_hamiltonian(k, system.spins, system.local_field) == pytest.approx(reference.delta_hamiltonian(i, j, False), abs=1e-6)
+
+@pytest.mark.parametrize("params", PARAMS)
+def test_batched_fields_match_per_agent(params):
+    groups, spins, T, J, nu, time_delay, dynamics, coupling_mode = params
+    systems = [SpinSystem(random.Random(seed), groups, spins, T, J, nu, time_delay=time_delay, dynamics=dynamics, coupling_mode=coupling_mode)
+               for seed in range(5)]
+    batch = BatchedSpinSystem(systems, seed=3)
+    history = [batch.flat_spins.copy()]
+    for _ in range(80):
+        batch.step()
+        history.append(batch.flat_spins.copy())
+        for n, system in enumerate(systems):
+            state = batch.spins[n]
+            assert np.allclose(batch.local_field[n], system._interaction_field(state), atol=1e-9)
+            if time_delay > 1:
+                delayed = history[max(0, len(history) - time_delay)][n]
+                assert np.array_equal(batch.delayed_spins[n], delayed)
+                assert np.allclose(batch.delayed_field[n], system._interaction_field(delayed.reshape(groups, spins)), atol=1e-9)
+            sums, counts = batch.activity()
+            active = state.ravel() == 1
+            assert counts[n] == np.count_nonzero(active)
+            assert sums[n] == pytest.approx(np.sum(np.exp(1j * system.angles)[active]), abs=1e-9)
+
+@pytest.mark.parametrize("mode", ["dense", "circulant", "low_rank"])
+def test_shared_coupling_tables_attach_by_name(mode):
+    coupling = RingCoupling(8, 3, 0.5, mode, use_shared_memory=True)
+    try:
+        blocks = len(coupling.owned_blocks)
+        attached = pickle.loads(pickle.dumps(coupling))
+        assert attached.owned_blocks == [] and sorted(attached.shared_blocks) == sorted(coupling.shared_blocks)
+        for key in RingCoupling.TABLES:
+            if getattr(coupling, key) is not None:
+                assert np.array_equal(getattr(attached, key), getattr(coupling, key))
+        # a dense table first used in some worker is private: nobody would unlink its block
+        assert np.array_equal(attached.dense_matrix(), coupling.dense_matrix())
+        assert len(coupling.owned_blocks) == blocks
+    finally:
+        coupling.release()
+    assert coupling.owned_blocks == []
+
+@pytest.mark.parametrize("time_delay", [1, 4])
+def test_kmc_class_rates_match_site_rates(time_delay):
+    groups, spins = 16, 4
+    system = SpinSystem(random.Random(5), groups, spins, 0.5, 1.0, 0.5, time_delay=time_delay, dynamics="kmc")
+    system.update_external_field(np.repeat(np.linspace(-0.3, 0.3, groups), spins))
+    for _ in range(300):
+        assert isinstance(system.step(), float)
+        site_rates, _ = system._kmc_rates(True, 33)
+        class_rates, _ = system._kmc_class_rates(True, 33)
+        expected = [class_rates[k // spins, system.kmc_class[k]] for k in range(groups * spins)]
+        assert np.allclose(site_rates, expected)
+        own = system.spins.ravel().astype(int)
+        delayed = system.get_delayed_states().ravel().astype(int) if time_delay > 1 else own
+        assert system.kmc_class == (2 * own + delayed).tolist()
+        assert np.array_equal(system.kmc_counts, [[len(members) for members in group] for group in system.kmc_members])
+
+def test_adaptive_window_slides_across_calls():
+    system = SpinSystem(random.Random(1), 16, 4, 0.5, 1.0, 0.5, time_delay=5)
+    steps = [system.run_spins_adaptive(1, 12, window=32, tolerance=0.01) for _ in range(200)]
+    assert min(steps) < 12
@@ -0,0 +1,24 @@
+import math
+import pickle
+import pytest
+from geometry_utils.vector3D import Vector3D, Vector3DArray
+
+def test_in_place_operators_keep_plus_equal_rebinding():
+    v = Vector3D(1, 2, 3)
+    alias = v
+    assert v.iadd(Vector3D(1, 1, 1)) is v and (alias.x, alias.y, alias.z) == (2, 3, 4)
+    v += Vector3D(1, 0, 0)
+    assert v is not alias and alias.x == 2 and v.x == 3
+    restored = pickle.loads(pickle.dumps(alias))
+    assert (restored.x, restored.y, restored.z) == (2, 3, 4)
+
+def test_array_rotation_matches_vectors():
+    points = [Vector3D(1, 0, 0.5), Vector3D(-0.5, 2, 0), Vector3D(0.25, -1, 1)]
+    center, angle = Vector3D(0.5, 0.5, 0), math.radians(33)
+    rotated = Vector3DArray.from_vectors(points).rotate_z(center, angle).translate(Vector3D(0, 1, 0))
+    for point, result in zip(points, rotated):
+        x, y = point.x - center.x, point.y - center.y
+        assert result.x == pytest.approx(center.x + x * math.cos(angle) - y * math.sin(angle))
+        assert result.y == pytest.approx(center.y + x * math.sin(angle) + y * math.cos(angle) + 1)
+        assert result.z == point.z
+    assert rotated.min().z == 0 and rotated.max().z == 1
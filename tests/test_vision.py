@@ -0,0 +1,59 @@
+import random
+import numpy as np
+import pytest
+from entity import EntityFactory
+from vision import BatchedVision
+from perception import BatchedPerception
+from geometry_utils.vector3D import Vector3D
+from baseline import reference_visual_field
+
+def _agents(behavior, model, number=12, seed=0, spread=1.5):
+    config = {"ticks_per_second": 1, "number": number, "linear_velocity": 0.1, "shape": "cylinder", "height": 0.02,
+              "diameter": 0.033, "detection": "visual", "moving_behavior": behavior, model[0]: model[1]}
+    agents = [EntityFactory.create_entity("agent_movable_0", config, n) for n in range(number)]
+    rng = random.Random(seed)
+    for agent in agents:
+        agent.position = Vector3D(rng.uniform(-spread, spread), rng.uniform(-spread, spread), 0.01)
+        agent.orientation = Vector3D(0, 0, rng.uniform(-180, 180))
+    return agents
+
+def _objects(seed=1, number=5):
+    rng = random.Random(seed)
+    positions = [Vector3D(rng.uniform(-1.5, 1.5), rng.uniform(-1.5, 1.5), 0.0) for _ in range(number)]
+    strengths = [rng.uniform(1, 5) for _ in range(number)]
+    uncertainties = [rng.choice([0.0, 0.1]) for _ in range(number)]
+    return {"object_static_0": ([None] * number, positions, strengths, uncertainties)}
+
+@pytest.mark.parametrize("visual_mode", ["binary", "area"])
+@pytest.mark.parametrize("seed", range(4))
+def test_visual_field_matches_reference(visual_mode, seed):
+    agents = _agents("vision", ("vision_model", {"visual_mode": visual_mode, "body_length": 0.3}), seed=seed)
+    objects = _objects(seed)
+    for agent in agents:
+        V, _, _ = agent.build_visual_field(objects, agents)
+        assert np.allclose(V, reference_visual_field(agent, objects, agents))
+
+@pytest.mark.parametrize("visual_mode", ["binary", "area"])
+@pytest.mark.parametrize("seed", range(4))
+def test_batched_visual_field_matches_reference(visual_mode, seed):
+    agents = _agents("vision", ("vision_model", {"visual_mode": visual_mode, "body_length": 0.3}), seed=seed)
+    objects = _objects(seed)
+    V = BatchedVision(agents).visual_fields(objects, agents)
+    for n, agent in enumerate(agents):
+        assert np.allclose(V[n], reference_visual_field(agent, objects, agents))
+
+def test_zero_perception_radius_sees_no_agents():
+    agents = _agents("vision", ("vision_model", {"visual_mode": "area", "body_length": 0.3, "perception_radius": 0.0}), spread=0.2)
+    objects = _objects()
+    V = BatchedVision(agents).visual_fields(objects, agents)
+    for n, agent in enumerate(agents):
+        assert np.allclose(V[n], reference_visual_field(agent, objects, []))
+
+@pytest.mark.parametrize("reference", ["egocentric", "allocentric"])
+def test_batched_perception_matches_per_agent(reference):
+    agents = _agents("spin_model", ("spin_model", {"num_groups": 16, "num_spins_per_group": 3, "reference": reference}))
+    objects = _objects()
+    perceptions = BatchedPerception(agents).perceptions(BatchedPerception.object_arrays(objects))
+    for n, agent in enumerate(agents):
+        agent.update_detection(objects)
+        assert np.allclose(perceptions[n], agent.perception)